@@ -4,19 +4,40 @@ import trio
 import os
 
 from dotenv import load_dotenv
-from flask import Flask, session, send_from_directory, request
+from flask import Flask, Response, session, send_from_directory, request
 from flask_cors import CORS
 from flask_session import Session
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, join_room, leave_room
 
-from gamecontroller import GameController
-from utils.api import create_response, create_error, param, has_role, has_character, broadcast_response
+from gamecontroller import GameRegistry, get_game_registry, set_game_registry
+from utils.api import create_response, create_error, param, has_role, has_character, broadcast_response, \
+    get_current_game, no_npc_phase, emit, instrumented
 from utils.character_stats import CharacterStats
 from utils.characters.character import Character
+from utils.metrics import get_metrics
+from utils.structured_log import get_logger, log_event, setup_logging
 from utils.position import Position
+from utils import wire_format
+from utils.sharding import LocalBroker, ShardRouter, ShardedGameRegistry
+from utils.simulation import SimulationJob
 
 load_dotenv()
 
+_log = get_logger("app")
+
+# game logs go to logs/civilwar.jsonl, written by a background thread. Started on import, so that it also runs
+# when the app is served by uwsgi instead of the __main__ block below
+setup_logging(os.getenv("LOG_DIR", "logs"))
+
+# a 41-character battle takes about 0.1s of one core, the maximum runs for minutes on a few cores
+MAX_SIMULATION_RUNS = 10000
+
+# running or last finished simulation per game room
+_simulations = {}
+
+# clients allowed to scrape /metrics
+METRICS_ADDRESSES = ["127.0.0.1", "::1"]
+
 ORIGINS = ["https://dnd.romanh.de", "https://localhost:3000", "http://localhost:3000"]
 
 app = Flask(__name__)
@@ -31,6 +52,14 @@ socketio = SocketIO(app, cors_allowed_origins=ORIGINS, cookie='session', manage_
 cors = CORS(app, origins=ORIGINS)
 
 
+def broadcast(event, data, game_room):
+    # games broadcast from their command queue thread, outside of any request context
+    wire_format.broadcast(event, data, game_room, socketio.emit)
+
+
+set_game_registry(GameRegistry(broadcast=broadcast))
+
+
 @app.before_request
 def before_request_callback():
     # Force setting cookie
@@ -43,24 +72,53 @@ def index_route():
     return send_from_directory('static', "index.html")
 
 
+@app.route("/metrics")
+def metrics_route():
+    # prometheus text format, local scrapers only
+    if request.remote_addr not in METRICS_ADDRESSES:
+        return Response("Forbidden", status=403)
+    return Response(get_metrics().to_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/<path:path>")
 def serve_static(path):
     return send_from_directory('static', path)
 
 
 @socketio.on("disconnect")
+@instrumented()
 def on_disconnect(*args):
+    wire_format.remove_client(request.sid)
     character_id = session.get("character", None)
-    character = GameController.instance().get_character(character_id)
+    character = get_current_game().get_character(character_id)
     if character:
         # GAME_CONTROLLER.remove_character(character_id)
         character.remove_client_sid(request.sid)
 
 
+def enter_room(game_room, new_format=None):
+    # (re-)joins the socket.io rooms of the given game and wire format, leaving the previous ones
+    client = wire_format.get_client(request.sid)
+    if client is not None:
+        old_room, old_format = client
+        leave_room(old_format.get_room(old_room))
+        leave_room(old_room)
+        new_format = old_format if new_format is None else new_format
+
+    new_format = wire_format.DEFAULT_WIRE_FORMAT if new_format is None else new_format
+    join_room(game_room)
+    join_room(new_format.get_room(game_room))
+    wire_format.set_client(request.sid, game_room, new_format)
+    return new_format
+
+
 @socketio.on("connect")
+@instrumented()
 def on_connect(*args):
+    # every client starts with the default (json) wire format
+    enter_room(get_current_game().get_room())
     character_id = session.get("character", None)
-    character = GameController.instance().get_character(character_id)
+    character = get_current_game().get_character(character_id)
     if character:
         character.add_client_sid(request.sid)
 
@@ -68,13 +126,56 @@ def on_connect(*args):
 #        emit("characterJoin", json_serialize(character), broadcast=True)
 
 
+@socketio.on("getWireFormats")
+@instrumented()
+def get_wire_formats(data):
+    schemas = dict((name, f.get_schema()) for name, f in wire_format.WIRE_FORMATS.items())
+    emit("getWireFormats", create_response(data=schemas))
+
+
+@socketio.on("setWireFormat")
+@instrumented()
+@param("name", required_type=str)
+def set_wire_format(data):
+    if data["name"] not in wire_format.WIRE_FORMATS:
+        supported = ", ".join(wire_format.WIRE_FORMATS.keys())
+        emit("setWireFormat", create_error(f"Unsupported wire format: {data['name']}, supported: {supported}"))
+        return
+
+    new_format = enter_room(get_current_game().get_room(), wire_format.get_wire_format(data["name"]))
+    emit("setWireFormat", create_response({"name": new_format.name, "schema": new_format.get_schema()}))
+
+
+@socketio.on("joinGame")
+@instrumented()
+@param("room", required_type=str)
+def join_game(data):
+    if not data["room"]:
+        emit("joinGame", create_error("Invalid room name"))
+        return
+
+    # characters and roles are bound to a game, leave the old one first
+    game_controller = get_current_game()
+    character = game_controller.get_character(session.get("character", None))
+    if character:
+        character.remove_client_sid(request.sid)
+
+    session["game"] = data["room"]
+    session["character"] = None
+    session["role"] = "player"
+    game_controller = get_current_game()
+    enter_room(game_controller.get_room())
+    emit("joinGame", create_response({"room": game_controller.get_room(), "status": game_controller.get_status()}))
+
+
 @socketio.on('chooseCharacter')
+@instrumented()
 @param("name", required_type=str)
 @param("password", required_type=str, optional=True)
 def choose_character(data):
-    logging.debug("socketIO chooseCharacter")
+    log_event(_log, logging.DEBUG, "choose character", name=data["name"])
     character_id = session.get("character", None)
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
 
     if game_controller.get_character(character_id) is not None:
         response = create_error("You already chose a character")
@@ -102,40 +203,50 @@ def choose_character(data):
 
 
 @socketio.on('getSelectableCharacters')
+@instrumented()
 def get_selectable_characters(data):
-    pc_configs = GameController.instance().get_character_configs(lambda c: c["type"] == "player")
+    pc_configs = get_current_game().get_character_configs(lambda c: c["type"] == "player")
     emit("getSelectableCharacters", create_response(data=pc_configs))
 
 
 @socketio.on("getCharacters")
+@instrumented()
+@param("since", required_type=int, optional=True)
 def get_characters(data):
-    response = create_response(data=GameController.instance().get_all_characters())
-    emit("getCharacters", response)
+    response = create_response(data=get_current_game().get_characters_since(data["since"]))
+    emit("getCharacters", wire_format.encode_for(request.sid, response))
 
 
 @socketio.on("getPCs")
+@instrumented()
 def get_playable_characters(data):
-    emit("getPCs", create_response(data=GameController.instance().get_player_characters()))
+    response = create_response(data=get_current_game().get_player_characters())
+    emit("getPCs", wire_format.encode_for(request.sid, response))
 
 
 @socketio.on("getAllies")
+@instrumented()
 def get_allies(data):
-    emit("getAllies", create_response(data=GameController.instance().get_allies()))
+    response = create_response(data=get_current_game().get_allies())
+    emit("getAllies", wire_format.encode_for(request.sid, response))
 
 
 @socketio.on("getEnemies")
+@instrumented()
 def get_enemies(data):
-    emit("getEnemies", create_response(data=GameController.instance().get_enemies()))
+    response = create_response(data=get_current_game().get_enemies())
+    emit("getEnemies", wire_format.encode_for(request.sid, response))
 
 
 @socketio.on('info')
+@instrumented()
 def api_info(data):
     player = {
         "role": session.get("role", "player"),
     }
 
     character_id = session.get("character", None)
-    character = GameController.instance().get_character(character_id)
+    character = get_current_game().get_character(character_id)
     player["character"] = character_id
     if character is not None:
         player["character"] = character
@@ -146,25 +257,30 @@ def api_info(data):
 
 
 @socketio.on('attack')
+@instrumented()
 @has_character()
+@no_npc_phase()
 @param("target", required_type=Character)
 def api_attack(data):
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
     character = game_controller.get_character(session["character"])
     response = game_controller.attack(character, data["target"])
     emit("attack", response)
 
 
 @socketio.on('cast')
+@instrumented()
 def api_cast(data):
     pass
 
 
 @socketio.on('move')
+@instrumented()
+@no_npc_phase()
 @param("target", required_type=Character, optional=True)
 @param("pos", required_type=Position)
 def api_move(data):
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
     target = data.get("target", None)
     own_character = game_controller.get_character(session.get("character", None))
 
@@ -183,9 +299,11 @@ def api_move(data):
 
 
 @socketio.on('dash')
+@instrumented()
 @has_character()
+@no_npc_phase()
 def dash(data):
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
     character_id = session.get("character")
     target = game_controller.get_character(character_id)
     response = game_controller.dash(target)
@@ -193,11 +311,13 @@ def dash(data):
 
 
 @socketio.on('pass')
+@instrumented()
 @has_character()
+@no_npc_phase()
 def api_pass_turn(data):
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
     character = game_controller.get_character(session["character"])
-    if game_controller.get_turn().get_active() != character:
+    if game_controller.get_active_character() != character:
         response = create_error("It's not your turn")
     else:
         response = game_controller.next_turn()
@@ -205,37 +325,38 @@ def api_pass_turn(data):
 
 
 @socketio.on('switchWeapon')
+@instrumented()
+@no_npc_phase()
 @param("name", required_type=str)
 @has_character()
 def api_switch_weapon(data):
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
     character = game_controller.get_character(session["character"])
-    if character._stunned > 0:
+    if character.is_stunned():
         emit("characterStunned", create_error("You are stunned"))
         return
-    weapon = character.get_weapon(data["name"])
-    if not weapon:
-        resp = create_error("You do not own such weapon")
-    else:
-        resp = character.switch_weapon(weapon)
-
+    resp = character.switch_weapon_by_name(data["name"])
     emit("switchWeapon", resp)
 
 
 ### DM methods
 @socketio.on('start')
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 def dm_start(data):
-    GameController.instance().start()
+    get_current_game().start()
     return create_response()
 
 
 @socketio.on('changeHealth')
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("target", required_type=int)
 @param("life", required_type=int, default=0, optional=True)
 def dm_change_health(data):
-    game_controller = GameController.instance()
+    game_controller = get_current_game()
     character = game_controller.get_character(data["target"])
     if character is None:
         emit("changeHealth", create_error("Character does not exist"))
@@ -246,21 +367,103 @@ def dm_change_health(data):
 
 
 @socketio.on('reset')
+@instrumented()
 @has_role("dm")
 def dm_reset(data):
-    GameController.reset()
-    emit("reset", {}, broadcast=True)
+    game_room = get_current_game().get_room()
+    get_game_registry().reset(game_room)
+    emit("reset", {}, to=game_room)
 
 
 @socketio.on('continue')
+@instrumented()
 @has_role("dm")
 def dm_continue(data):
-    resp = GameController.instance().next_turn()
+    resp = get_current_game().next_turn()
     broadcast_response(resp)
 
 
+@socketio.on("simulate")
+@instrumented()
+@has_role("dm")
+@param("runs", required_type=int, optional=True, default=1000)
+@param("maxRounds", required_type=int, optional=True, default=100)
+def dm_simulate(data):
+    # the simulation runs in the background, simulationProgress events are sent to the requesting client
+    if not 0 < data["runs"] <= MAX_SIMULATION_RUNS:
+        emit("simulate", create_error(f"Invalid amount of runs, allowed: 1-{MAX_SIMULATION_RUNS}"))
+        return
+
+    game_controller = get_current_game()
+    running_job = _simulations.get(game_controller.get_room(), None)
+    if running_job is not None and running_job.is_running():
+        emit("simulate", create_error("A simulation is already running"))
+        return
+
+    client_sid = request.sid
+    job = SimulationJob(data["runs"], lambda j: socketio.emit("simulationProgress", create_response({"job": j}),
+                                                                to=client_sid))
+    _simulations[game_controller.get_room()] = job
+    socketio.start_background_task(job.run, game_controller, max_rounds=data["maxRounds"])
+    emit("simulate", create_response({"job": job}))
+
+
+@socketio.on("cancelSimulation")
+@instrumented()
+@has_role("dm")
+def dm_cancel_simulation(data):
+    job = _simulations.get(get_current_game().get_room(), None)
+    if job is None or not job.is_running():
+        emit("cancelSimulation", create_error("No simulation running"))
+        return
+
+    job.cancel()
+    emit("cancelSimulation", create_response({"job": job}))
+
+
+@socketio.on("getCommandStats")
+@instrumented()
+@has_role("dm")
+def dm_get_command_stats(data):
+    emit("getCommandStats", create_response(data=get_current_game().get_command_stats()))
+
+
+@socketio.on("getMetrics")
+@instrumented()
+@has_role("dm")
+def dm_get_metrics(data):
+    emit("getMetrics", create_response(data=get_metrics().to_json()))
+
+
+@socketio.on("cancelPhase")
+@instrumented()
+@has_role("dm")
+def dm_cancel_phase(data):
+    emit("cancelPhase", get_current_game().cancel_npc_phase())
+
+
+@socketio.on("getTerrain")
+@instrumented()
+def get_terrain(data):
+    emit("getTerrain", create_response(data=get_current_game().get_terrain_json()))
+
+
+@socketio.on("setTerrain")
+@instrumented()
+@has_role("dm")
+@no_npc_phase()
+@param("min", required_type=Position)
+@param("max", required_type=Position)
+@param("cost", optional=True)
+def dm_set_terrain(data):
+    # cost: None for an obstacle, 1 for open ground or more for rough terrain
+    emit("setTerrain", get_current_game().set_terrain(data["min"], data["max"], data["cost"]))
+
+
 @socketio.on("place")
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("target", required_type=Character)
 @param("pos", required_type=Position)
 def place(data):
@@ -269,15 +472,19 @@ def place(data):
 
 
 @socketio.on('addTurn')
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("target", required_type=Character)
 def dm_add_turn(data):
-    resp = GameController.instance().add_turn(data["target"])
+    resp = get_current_game().add_turn(data["target"])
     emit("addTurn", resp)
 
 
 @socketio.on('stun')
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("target", required_type=Character)
 def dm_stun(data):
     response = data["target"].stun(1)
@@ -285,24 +492,31 @@ def dm_stun(data):
 
 
 @socketio.on('createNPCs')
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("allies", required_type=bool)
 @param("amount", required_type=int)
+@param("placement", required_type=str, optional=True, default="uniform")
 def dm_create_npcs(data):
-    game_controller = GameController.instance()
-    response = game_controller.create_npcs(data["amount"], data["allies"])
+    game_controller = get_current_game()
+    response = game_controller.create_npcs(data["amount"], data["allies"], data["placement"])
     emit("createNPCs", response)
 
 
 @socketio.on("kill")
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("target", required_type=Character)
 def dm_kill(data):
     data["target"].kill(reason="DM kill")
 
 
 @socketio.on('changeSelChar')
+@instrumented()
 @has_role("dm")
+@no_npc_phase()
 @param("character", required_type=Character)
 @param("stats", required_type=CharacterStats)
 def dm_change_char(data):
@@ -315,6 +529,14 @@ def dm_change_char(data):
     emit("changeSelChar", create_response())
 
 
+def start_shards(shards):
+    # games are hosted by shard worker processes, this process only forwards commands and fans out events
+    router = ShardRouter(LocalBroker(shards), socketio.emit)
+    router.start()
+    set_game_registry(ShardedGameRegistry(router))
+    return router
+
+
 if __name__ == "__main__":
     log_file = 'logs/debug.log'
     log_dir = os.path.dirname(log_file)
@@ -326,4 +548,7 @@ if __name__ == "__main__":
     host = os.getenv("APP_HOST", "localhost")
     port = int(os.getenv("APP_PORT", "3000"))
     debug = os.getenv('APP_DEBUG', "0").lower() in ["true","1","yes"]
+    shards = int(os.getenv("APP_SHARDS", "0"))
+    if shards > 0:
+        start_shards(shards)
     socketio.run(app, host=host, port=port, debug=debug)
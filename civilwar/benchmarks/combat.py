@@ -0,0 +1,198 @@
+"""Benchmark of the combat core on synthetic games built from the character configs.
+
+Times start, the NPC phases of next_turn, get_game_state, serializing the roster and the AoE/line
+queries for games with 10 to 5000 NPCs. Socket emission is stubbed out. Results are written as JSON
+and compared against the stored baseline, timings slower than baseline * TOLERANCE are regressions.
+
+Absolute timings only compare on the machine and numpy version the baseline was recorded with (see its
+meta). Every size also times a fixed reference workload right before its game, baseline timings are
+scaled by the ratio of the two reference timings before comparing, so a faster, slower or busier machine
+is not flagged as a whole.
+Re-record the baseline with the pinned requirements after changing a measured path.
+
+Run from the civilwar directory: python -m benchmarks.combat [--sizes 10 100] [--save-baseline]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+import numpy as np
+
+from gamecontroller import GameController
+from utils.api import json_serialize
+from utils.position import Position
+
+SIZES = [10, 100, 1000, 5000]
+RESULTS_FILE = "benchmarks/results/combat.json"
+BASELINE_FILE = "benchmarks/baseline.json"
+TOLERANCE = 1.25
+# differences below this (seconds) are timer noise, never regressions
+MIN_DELTA = 50e-6
+
+# NPC phases played per game, the first phases of a fight are the most expensive ones
+PHASES = 4
+
+
+def _stub_broadcast(event, data, room):
+    pass
+
+
+def build_game(amount, seed=1):
+    # one player + amount NPCs (half allies, half enemies) spawned like the DM would
+    game_controller = GameController("benchmark", broadcast=_stub_broadcast, seed=seed)
+    game_controller.create_pc("bart")
+    game_controller.create_npcs(amount - amount // 2, True)
+    game_controller.create_npcs(amount // 2, False)
+    return game_controller
+
+
+def _best_of(fn, number, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        timings.append(timeit.timeit(fn, number=number) / number)
+    return min(timings)
+
+
+def bench_size(amount, repeat=5):
+    reference = _best_of(_reference_workload, 10, repeat)
+    game_controller = build_game(amount)
+    characters = list(game_controller.get_all_characters().values())
+    number = max(1, 1000 // amount)
+    row = {"reference": reference, "start": _best_of(game_controller.start, 1, repeat)}
+
+    # the player passes, then allies and enemies take turns
+    game_controller.next_turn(background=False)
+    phase_timings, npc_turns = [], 0
+    for _ in range(PHASES):
+        if game_controller.get_game_state() != "ongoing":
+            break
+        started = time.perf_counter()
+        response = game_controller.next_turn(background=False)
+        phase_timings.append(time.perf_counter() - started)
+        if "phase" in response["data"]:
+            npc_turns += response["data"]["phase"]["done"]
+        else:
+            # players' turn, pass it
+            phase_timings.pop()
+    row["npc_phase"] = float(np.mean(phase_timings))
+    row["npc_turn"] = sum(phase_timings) / max(1, npc_turns)
+
+    row["get_game_state"] = _best_of(game_controller.get_game_state, 10000, repeat)
+
+    def invalidate():
+        for character in characters:
+            character._mark_dirty()
+
+    roster = list(game_controller.get_all_characters().values())
+    row["serialize_roster"] = _best_of(lambda: json_serialize(roster), 1, repeat, setup=invalidate)
+    row["serialize_roster_cached"] = _best_of(lambda: json_serialize(roster), number, repeat)
+
+    start_pos, dest_pos = Position(500, 342), Position(900, 100)
+    row["aoe"] = _best_of(lambda: game_controller.get_characters_aoe(start_pos, 120), number * 10, repeat)
+    row["line"] = _best_of(lambda: game_controller.get_characters_line(start_pos, dest_pos, 120), number * 10, repeat)
+    game_controller.close()
+    return row
+
+
+def _reference_workload():
+    # fixed dict/loop and numpy work independent of the game code, times the machine
+    counts = {}
+    for i in range(20000):
+        counts[i % 997] = counts.get(i % 997, 0) + i
+    np.sort(np.arange(20000, dtype=np.float64)[::-1])
+
+
+def run(sizes=None, repeat=5):
+    results = {}
+    for amount in SIZES if sizes is None else sizes:
+        results[str(amount)] = bench_size(amount, repeat)
+
+    return {
+        "meta": {
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+
+
+def machine_scale(row, baseline_row):
+    # how much slower the machine was than during the baseline, 1 if either row has no reference timing
+    reference, baseline_reference = row.get("reference"), baseline_row.get("reference")
+    if not reference or not baseline_reference:
+        return 1.0
+    return reference / baseline_reference
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # (size, metric, seconds, scaled baseline seconds, ratio) of all timings present in both
+    comparison = []
+    for size, row in results["results"].items():
+        baseline_row = baseline["results"].get(size, {})
+        scale = machine_scale(row, baseline_row)
+        for metric, seconds in row.items():
+            if metric in baseline_row and metric != "reference":
+                baseline_seconds = baseline_row[metric] * scale
+                comparison.append((size, metric, seconds, baseline_seconds, seconds / baseline_seconds))
+    return comparison, [c for c in comparison if c[4] > tolerance and c[2] - c[3] > MIN_DELTA]
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as writer:
+        json.dump(data, writer, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the combat core")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+    _write_json(args.output, results)
+    print(f"Results written to {args.output}")
+
+    regressions = []
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, "r") as reader:
+            baseline = json.load(reader)
+        for key in ["python", "numpy", "machine"]:
+            if results["meta"][key] != baseline["meta"].get(key):
+                print(f"Warning: baseline was recorded with {key} {baseline['meta'].get(key)}, "
+                      f"this run uses {results['meta'][key]}")
+        comparison, regressions = compare(results, baseline, args.tolerance)
+        for entry in comparison:
+            size, metric, seconds, baseline_seconds, ratio = entry
+            flag = "  REGRESSION" if entry in regressions else ""
+            print(f"{size:>5} NPCs {metric:>24}: {seconds * 1e3:12.4f}ms "
+                  f"(baseline {baseline_seconds * 1e3:12.4f}ms, x{ratio:5.2f}){flag}")
+    else:
+        for size, row in results["results"].items():
+            for metric, seconds in row.items():
+                print(f"{size:>5} NPCs {metric:>24}: {seconds * 1e3:12.4f}ms")
+
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""Memory benchmark: bytes per character traced by tracemalloc while spawning NPCs.
+
+Also times the distance and movement math of Position.
+
+Run from the civilwar directory: python -m benchmarks.memory [amount]
+"""
+import sys
+import timeit
+import tracemalloc
+
+from gamecontroller import GameController
+from utils.position import Position
+
+AMOUNT = 10000
+
+
+def measure_spawn(amount=AMOUNT):
+    # (bytes per NPC still allocated after the spawn, peak bytes per NPC during it, top allocation sites)
+    game_controller = GameController("benchmark", headless=True, seed=1)
+    game_controller.create_npcs(10, True)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    game_controller.create_npcs(amount - amount // 2, True)
+    game_controller.create_npcs(amount // 2, False)
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    base = sum(stat.size for stat in before.statistics("filename"))
+    top = after.compare_to(before, "lineno")[:8]
+    return (current - base) / amount, (peak - base) / amount, top
+
+
+def measure_movement(number=200000):
+    bounds = [0, 0, 999, 683]
+    pos, other = Position(120, 340), Position(530.5, 80.25)
+    return {
+        "distance": timeit.timeit(lambda: pos.distance(other), number=number) / number,
+        "normalize_distance": timeit.timeit(lambda: pos.normalize_distance(other, 40, bounds), number=number) / number,
+    }
+
+
+def run(amount=AMOUNT):
+    per_character, peak_per_character, top = measure_spawn(amount)
+    return per_character, peak_per_character, top, measure_movement()
+
+
+if __name__ == "__main__":
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else AMOUNT
+    per_character, peak_per_character, top, movement = run(amount)
+    print(f"{amount} NPCs: {per_character:8.0f} bytes per character, peak {peak_per_character:8.0f} bytes per character")
+    print("largest allocation sites:")
+    for stat in top:
+        print(f"  {stat.size_diff / amount:8.1f} B/char  {stat.traceback[0].filename}:{stat.traceback[0].lineno}")
+    for name, seconds in movement.items():
+        print(f"{name:>20}: {seconds * 1e9:8.1f}ns")
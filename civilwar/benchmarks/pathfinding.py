@@ -0,0 +1,68 @@
+"""Flow field benchmark: field updates and NPC faction phases on a map with a wall between the factions.
+
+Run from the civilwar directory: python -m benchmarks.pathfinding [amount]
+"""
+import sys
+import time
+
+from gamecontroller import GameController
+from utils.constants import FACTION_ALLY
+from utils.flow_field import FlowField
+from utils.position import Position
+from utils.terrain import OBSTACLE_COST, OPEN_COST
+
+AMOUNT = 500
+TURNS = 20
+
+
+def build_game(amount, seed=1):
+    # a wall across the middle of the map with a gap on the right
+    game_controller = GameController("benchmark", headless=True, seed=seed)
+    game_controller.create_pc("bart")
+    game_controller.create_npcs(amount, True)
+    game_controller.create_npcs(amount, False)
+    game_controller.set_terrain(Position(0, 330), Position(850, 350))
+    return game_controller
+
+
+def measure_updates(game_controller, number=50):
+    # seconds per full computation and per incremental update after a typical change
+    field = game_controller.get_flow_field(FACTION_ALLY)
+    terrain = game_controller.get_terrain()
+    targets = sorted(field.get_targets())
+    moved = targets[1:] + [(targets[0][0], targets[0][1] + 1)]
+    timings = {"full update": 0, "add target": 0, "move target": 0, "remove target": 0, "add obstacle": 0}
+    for _ in range(number):
+        start = time.perf_counter()
+        FlowField(terrain).update(targets)
+        timings["full update"] += time.perf_counter() - start
+
+        for name, cells in [("remove target", targets[1:]), ("add target", targets), ("move target", moved)]:
+            start = time.perf_counter()
+            field.update(cells)
+            timings[name] += time.perf_counter() - start
+        field.update(targets)
+
+        terrain.set_cost(Position(600, 100), Position(700, 110), OBSTACLE_COST)
+        start = time.perf_counter()
+        field.update(targets)
+        timings["add obstacle"] += time.perf_counter() - start
+        terrain.set_cost(Position(600, 100), Position(700, 110), OPEN_COST)
+        field.update(targets)
+    return dict((name, seconds / number) for name, seconds in timings.items())
+
+
+def measure_phases(game_controller, turns=TURNS):
+    game_controller.start()
+    start = time.perf_counter()
+    for _ in range(turns):
+        game_controller.next_turn(background=False)
+    return (time.perf_counter() - start) / turns
+
+
+if __name__ == "__main__":
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else AMOUNT
+    game_controller = build_game(amount)
+    for name, seconds in measure_updates(game_controller).items():
+        print(f"{name:>13}: {seconds * 1e3:8.3f}ms")
+    print(f"{'turn':>13}: {measure_phases(game_controller) * 1e3:8.3f}ms ({amount} NPCs per faction)")
@@ -0,0 +1,86 @@
+"""Micro-benchmark of the vectorized AoE/line queries against a naive per-character loop.
+
+Run from the civilwar directory: python -m benchmarks.queries
+"""
+import random
+import timeit
+
+from gamecontroller import GameController
+from utils.constants import OG_METER
+from utils.position import Position
+
+SIZES = [10, 100, 10000]
+
+
+def naive_aoe(characters, start_pos, r, exclude=None):
+    radius = r / OG_METER
+    hits = [(start_pos.distance(c.get_pos()), c) for c in characters
+            if c is not exclude and not c.is_dead() and start_pos.distance(c.get_pos()) <= radius]
+    return [c for _, c in sorted(hits, key=lambda hit: hit[0])]
+
+
+def naive_line(characters, start_pos, dest_pos, r, pierce=True, width=5, exclude=None):
+    direction = (dest_pos - start_pos).normalize()
+    length = min(start_pos.distance(dest_pos), r / OG_METER)
+    hits = []
+    for c in characters:
+        if c is exclude or c.is_dead():
+            continue
+        relative = c.get_pos() - start_pos
+        along = relative[0] * direction[0] + relative[1] * direction[1]
+        across = abs(relative[0] * direction[1] - relative[1] * direction[0])
+        if 0 <= along <= length and across <= (width / OG_METER) / 2:
+            hits.append((relative.length(), c))
+
+    hits = [c for _, c in sorted(hits, key=lambda hit: hit[0])]
+    return hits if pierce else hits[:1]
+
+
+def build_game(amount):
+    game_controller = GameController()
+    template = game_controller.get_character_template("villager")
+    bounds = game_controller.get_map_bounds()
+    for i in range(amount):
+        position = Position.random(bounds[:2], bounds[2:])
+        game_controller.create_npc(f"Villager-{i}", position, template, i % 2 == 0)
+    return game_controller
+
+
+def run(repeat=20):
+    random.seed(1)
+    results = []
+    for amount in SIZES:
+        game_controller = build_game(amount)
+        characters = list(game_controller.get_all_characters().values())
+        start_pos, dest_pos = Position(500, 342), Position(900, 100)
+        r = 120
+
+        assert game_controller.get_characters_aoe(start_pos, r) == naive_aoe(characters, start_pos, r)
+        assert game_controller.get_characters_line(start_pos, dest_pos, r) == \
+               naive_line(characters, start_pos, dest_pos, r)
+
+        number = max(1, 10000 // amount)
+        timings = {
+            "aoe": game_controller.get_characters_aoe,
+            "aoe_naive": lambda *args: naive_aoe(characters, *args),
+        }
+        line_timings = {
+            "line": game_controller.get_characters_line,
+            "line_naive": lambda *args: naive_line(characters, *args),
+        }
+
+        row = {"characters": amount}
+        for name, fn in timings.items():
+            row[name] = min(timeit.repeat(lambda: fn(start_pos, r), number=number, repeat=repeat)) / number
+        for name, fn in line_timings.items():
+            row[name] = min(timeit.repeat(lambda: fn(start_pos, dest_pos, r), number=number, repeat=repeat)) / number
+        results.append(row)
+
+    return results
+
+
+if __name__ == "__main__":
+    for row in run():
+        print(f"{row['characters']:>6} characters: "
+              f"aoe {row['aoe'] * 1e6:9.1f}us (naive {row['aoe_naive'] * 1e6:9.1f}us), "
+              f"line {row['line'] * 1e6:9.1f}us (naive {row['line_naive'] * 1e6:9.1f}us)")
@@ -0,0 +1,48 @@
+"""Compares encode time and frame size of the socket wire formats.
+
+Run from the civilwar directory: python -m benchmarks.wire_formats
+"""
+import random
+import timeit
+
+from benchmarks.queries import build_game
+from utils.api import create_response, json_serialize
+from utils.position import Position
+from utils.wire_format import WIRE_FORMATS
+
+SIZES = [10, 100, 1000]
+
+
+def build_payloads(game_controller):
+    roster = create_response(data=game_controller.get_characters_since(None))
+    events = {"events": [
+        {"type": "characterMove", "characterId": c.get_id(), "to": Position(c.get_pos()[0] + 5, c.get_pos()[1]),
+         "movementLeft": 0, "timestamp": 0, "seq": i}
+        for i, c in enumerate(game_controller.get_all_characters().values())
+    ]}
+    return {"roster": roster, "events": json_serialize(events)}
+
+
+def run(repeat=5):
+    random.seed(1)
+    results = []
+    for amount in SIZES:
+        payloads = build_payloads(build_game(amount))
+        for payload_name, payload in payloads.items():
+            for wire_format in WIRE_FORMATS.values():
+                # socket.io json-encodes non-binary payloads, count that as part of the encoding
+                def encode():
+                    return wire_format.frame_size(wire_format.encode(payload))
+
+                number = max(1, 1000 // amount)
+                seconds = min(timeit.repeat(encode, number=number, repeat=repeat)) / number
+                results.append({"characters": amount, "payload": payload_name, "format": wire_format.name,
+                                "encode": seconds, "size": encode()})
+
+    return results
+
+
+if __name__ == "__main__":
+    for row in run():
+        print(f"{row['characters']:>5} characters {row['payload']:>7} {row['format']:>8}: "
+              f"{row['encode'] * 1e3:8.3f}ms {row['size']:>9} bytes")
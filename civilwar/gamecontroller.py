@@ -1,49 +1,173 @@
 import json
 import logging
 import os.path
+import pickle
 import time
 import copy
 from threading import Lock
 
-from flask_socketio import emit
+import numpy as np
 
 from utils.api import create_response, create_error, json_serialize
+from utils.character_table import CharacterTable
+from utils.character_template import CharacterTemplate
+from utils.dice import Dice
+from utils.command_queue import CommandQueue, CommandQueueStopped, InlineCommandQueue, game_command
 from utils.characters.character import Character
 from utils.characters.npc import NPC
 from utils.characters.player_character import PlayerCharacter
+from utils.event_buffer import EventBuffer
+from utils.faction_phase import FactionPhase
+from utils.flow_field import FlowField
+from utils.npc_phase import NPCPhase
+from utils.occupancy import OccupancyGrid
+from utils.placement import PLACEMENTS, place
 from utils.position import Position
+from utils.spatial_index import SpatialIndex
+from utils.state_log import StateLog
+from utils.structured_log import get_logger, log_event
+from utils.terrain import TerrainGrid, OBSTACLE_COST, OPEN_COST
 from utils.turn_order import GameTurnOrder
 from utils.util import CaseInsensitiveDict
 from utils.vec2 import Vector2D
-from utils.constants import OG_METER
+from utils import wire_format
+from utils.constants import MEELE_RANGE, OG_METER, STATUS_ALIVE, STATUS_KO, \
+    FACTION_PLAYER, FACTION_ALLY, FACTION_ENEMY, HOSTILE_FACTIONS
+
+_log = get_logger("game")
+_move_log = get_logger("move")
+_event_log = get_logger("events")
+_config_log = get_logger("config")
+
+FACTION_NAMES = {
+    FACTION_PLAYER: "players",
+    FACTION_ALLY: "allies",
+    FACTION_ENEMY: "enemies",
+}
+
+
+def _no_broadcast(event, data, room):
+    pass
 
 
 class GameController:
-    _instance = None
 
-    CHARACTER_ID = 1
+    # game events are sent in batches of at most this size, or once the oldest buffered event is this old (seconds)
+    EVENT_BATCH_SIZE = 250
+    EVENT_FLUSH_INTERVAL = 0.5
+
+    # number of upcoming turns included in the game status
+    TURN_PREVIEW_SIZE = 10
+
+    def __init__(self, room=None, first_character_id=1, broadcast=None, headless=False, seed=None):
+
+        # socket.io room of this game, all broadcasts are scoped to it
+        self._room = room
+
+        # headless games (simulations) neither send events nor broadcast and run their commands inline
+        self._headless = headless
 
-    def __init__(self):
+        # broadcast(event, data, room), replaced when the game runs in a shard worker process
+        self._broadcast = wire_format.broadcast if broadcast is None else broadcast
+        if headless:
+            self._broadcast = _no_broadcast
+
+        # important: do not re-use character ids!
+        self._next_character_id = first_character_id
 
         # map attributes
         self._map_size = Vector2D(1000, 684)
 
+        # movement cost + obstacles of the map, and one flow field per set of target factions
+        self._terrain = TerrainGrid(self._map_size)
+        self._flow_fields = {}
+        # flow fields towards single characters, for characters chasing a target the shared field does not lead to
+        self._target_flow_fields = {}
+        # increased whenever a possible flow field target moves, spawns or dies
+        self._targets_version = 0
+
+        # all dice of this game, seed it to replay a game
+        self._dice = Dice(seed)
+
         # game turn order + round counter + characters
         self._turn_order = GameTurnOrder()
         self._chars = {}
-        self.mutex = Lock()
 
-        # character configs
+        # every mutation runs on this single-consumer queue, one game never blocks another
+        self._commands = InlineCommandQueue() if headless else CommandQueue(room)
+
+        # spatial index over all living characters, used for range queries
+        self._spatial_index = SpatialIndex()
+
+        # tokens of all living characters, keeps them from ending their moves on top of each other
+        self._occupancy = OccupancyGrid()
+
+        # array-backed copy of the combat state of all characters, used for vectorized queries
+        self._table = CharacterTable()
+
+        # alive/ko/dead counters per faction + last counted status per character id
+        self._status_counts = dict((faction, {"alive": 0, "ko": 0, "dead": 0}) for faction in FACTION_NAMES)
+        self._tracked_status = {}
+
+        # characters per faction, all of them and the ones not dead, keyed by id in roster order
+        self._members = dict((faction, {}) for faction in FACTION_NAMES)
+        self._alive_members = dict((faction, {}) for faction in FACTION_NAMES)
+
+        # versioned character state, allows clients to fetch only the changes since a sequence number
+        self._state_log = StateLog()
+
+        # buffers game events during turns/spawns and sends them as one gameEvents frame
+        self._event_buffer = EventBuffer(self._emit_game_events, self.EVENT_BATCH_SIZE, self.EVENT_FLUSH_INTERVAL)
+
+        # running NPC faction phase + its crowding cache
+        self._npc_phase = None
+        self._faction_phase = None
+
+        # character configs, as read from the files and compiled into shared templates
         self._character_configs = CaseInsensitiveDict()
+        self._character_templates = CaseInsensitiveDict()
         self._load_character_configs()
 
-    @staticmethod
-    def next_char_id():
-        # important: do not re-use character ids!
-        next_id = GameController.CHARACTER_ID
-        GameController.CHARACTER_ID += 1
+    def __getstate__(self):
+        # pickled games are restored as headless copies, see snapshot
+        state = self.__dict__.copy()
+        for key in ["_broadcast", "_commands", "_event_buffer", "_npc_phase", "_faction_phase"]:
+            del state[key]
+        state["_character_configs"] = dict(self._character_configs)
+        state["_character_templates"] = dict(self._character_templates)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._character_configs = CaseInsensitiveDict(state["_character_configs"])
+        self._character_templates = CaseInsensitiveDict(state["_character_templates"])
+        self._headless = True
+        self._broadcast = _no_broadcast
+        self._commands = InlineCommandQueue()
+        self._event_buffer = EventBuffer(self._emit_game_events, self.EVENT_BATCH_SIZE, self.EVENT_FLUSH_INTERVAL)
+        self._npc_phase = None
+        self._faction_phase = None
+
+    @game_command
+    def snapshot(self):
+        # the pickled game state, restored as a headless copy e.g. to simulate the rest of the battle
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def is_headless(self):
+        return self._headless
+
+    def get_room(self):
+        return self._room
+
+    def get_dice(self):
+        return self._dice
+
+    def next_char_id(self):
+        next_id = self._next_character_id
+        self._next_character_id += 1
         return next_id
 
+    @game_command
     def start(self):
         self._turn_order.reset()
 
@@ -68,54 +192,102 @@ class GameController:
         self._turn_order.get_next()
         self.send_game_status()
 
-    def create_npc(self, name, position, character_config, is_ally):
+    @game_command
+    def create_npc(self, name, position, template, is_ally):
         character_id = self.next_char_id()
-        npc = NPC(character_id, character_config, name, position, is_ally)
-        self._chars[character_id] = npc
+        npc = NPC(character_id, template, name, position, is_ally)
+        self._add_character(npc)
         return npc
 
-    def create_npcs(self, amount=20, allies=True):
+    @game_command
+    def create_npcs(self, amount=20, allies=True, placement="uniform"):
 
         if amount < 1:
             return create_error("Invalid amount, you need to create at least 1 NPC")
-
-        villager_config = self._character_configs["villager"]
-        veteran_config = self._character_configs["veteran"]
-        npcs = {}
-
-        for i in range(amount):
-            character_config = (veteran_config if i % 5 == 0 else villager_config).copy()
-
-            if allies:
-                position = Position.random([0, self._map_size[1] - 150], self._map_size - [1, 1])
-                suffix = "ally"
-            else:
-                position = Position.random([0, 0], self._map_size - [1, 150])
-                suffix = "enemy"
-
-            name = f"{character_config['name']}-{len(self._chars)}_{suffix}"
-            npc = self.create_npc(name, position, character_config, allies)
-            npcs[npc.get_id()] = npc
-
-        self.send_game_event("charactersSpawned", {"characters": npcs})
+        elif placement not in PLACEMENTS:
+            return create_error(f"Invalid placement: {placement}, supported: {', '.join(PLACEMENTS)}")
+
+        villager_template = self._character_templates["villager"]
+        veteran_template = self._character_templates["veteran"]
+        suffix = "ally" if allies else "enemy"
+
+        # allies spawn at the bottom of the map, their front line faces the enemies at the top
+        min_bounds, max_bounds = self.get_spawn_zone(allies)
+        positions = place(placement, amount, min_bounds, max_bounds, self._dice, front_first=allies)
+        if not self._terrain.is_open():
+            positions = np.array([self._terrain.nearest_open(pos) for pos in positions.tolist()], dtype=np.int64)
+
+        first_index, npcs = len(self._chars), []
+        for i, (x, y) in enumerate(positions.tolist()):
+            template = veteran_template if i % 5 == 0 else villager_template
+            name = f"{template.name}-{first_index + i}_{suffix}"
+            npcs.append(NPC(self.next_char_id(), template, name, Position(x, y), allies))
+
+        self._add_characters(npcs)
+        self.send_game_event("charactersSpawned", self._get_spawn_payload(npcs))
         return create_response()
 
+    def get_spawn_zone(self, allies):
+        # (min, max) corners of the spawn zone of allies or enemies, inclusive
+        if allies:
+            return [0, self._map_size[1] - 150], [self._map_size[0] - 1, self._map_size[1] - 1]
+        return [0, 0], [self._map_size[0] - 1, self._map_size[1] - 150]
+
+    @staticmethod
+    def _get_spawn_payload(npcs):
+        # fields shared by all NPCs of a template are sent once, every NPC as [id, name, template, x, y]
+        templates, characters = {}, []
+        for npc in npcs:
+            template_name = npc.get_template().name
+            if template_name not in templates:
+                fields = npc.serialize().copy()
+                for key in ["id", "name", "pos"]:
+                    del fields[key]
+                templates[template_name] = fields
+            pos = npc.get_pos()
+            characters.append([npc.get_id(), npc.get_name(), template_name, pos[0], pos[1]])
+        return {"templates": templates, "characters": characters}
+
+    @game_command
     def create_pc(self, character_name):
-        logging.debug("GameController.create_pc")
-        character_config = self._character_configs.get(character_name, None)
-        if not character_config:
+        log_event(_log, logging.DEBUG, "create pc", room=self._room, character=character_name)
+        template = self._character_templates.get(character_name, None)
+        if not template:
             return create_error(f"Invalid character: {character_name}")
-        elif character_config["type"] != "player":
+        elif template.type != "player":
             return create_error(f"Chosen character is not a playable character")
 
         character_id = self.next_char_id()
-        character = PlayerCharacter(character_id, character_config)
-        self._chars[character_id] = character
+        character = PlayerCharacter(character_id, template)
+        self._add_character(character)
         return character
 
+    def _add_character(self, character: Character):
+        self._add_characters([character])
+
+    def _add_characters(self, characters):
+        # adds new characters to the roster and all indexes at once
+        for character in characters:
+            character.set_game(self)
+            self._chars[character.get_id()] = character
+            self._members[character.get_faction()][character.get_id()] = character
+            self._track_status(character)
+        self._spatial_index.insert_many(characters)
+        self._occupancy.insert_many(characters)
+        self._table.add_many(characters)
+        self._state_log.mark_changed_many(characters)
+        self._targets_version += 1
+        self._invalidate_faction_phase()
+
     def get_all_characters(self):
         return self._chars
 
+    @game_command
+    def get_characters_since(self, since=None):
+        # changed character fields since the given sequence number, or a full snapshot if that is not possible
+        changes = None if since is None else self._state_log.get_changes_since(since)
+        return changes if changes is not None else self._state_log.get_snapshot()
+
     def get_characters_by(self, *filters):
         filtered_chars = self._chars.values()
         for f in filters:
@@ -123,81 +295,118 @@ class GameController:
 
         return filtered_chars
 
+    def get_characters_in_radius(self, pos, radius, *filters):
+        # living characters within radius (pixels), in roster order
+        characters = self._spatial_index.query_radius(pos, radius)
+        for f in filters:
+            characters = filter(f, characters)
+
+        return characters
+
+    def get_closest_character(self, pos, *filters):
+        # closest living character matching all filters, None if there is none
+        return self._spatial_index.nearest(pos, lambda c: all(f(c) for f in filters))
+
+    def get_melee_crowding(self, character):
+        # number of living enemies of character standing in melee range
+        if self._faction_phase is not None:
+            return self._faction_phase.get_melee_crowding(character)
+        return len(list(character.get_enemies_with_distance(distance=MEELE_RANGE / OG_METER)))
+
+    def _invalidate_faction_phase(self):
+        if self._faction_phase is not None:
+            self._faction_phase.invalidate()
+
     def get_characters_by_type(self, t):
         return filter(lambda c: isinstance(c, t), self._chars.values())
 
+    def get_faction_members(self, faction, only_alive=False):
+        # characters of the given faction in roster order
+        members = self._alive_members[faction] if only_alive else self._members[faction]
+        return list(members.values())
+
+    @game_command
     def get_player_characters(self, only_alive=False):
-        players = self.get_characters_by_type(PlayerCharacter)
-        if only_alive:
-            players = filter(lambda p: not p.is_dead(), players)
-        return players
+        return self.get_faction_members(FACTION_PLAYER, only_alive)
 
+    @game_command
     def get_allies(self, only_alive=False):
-        allies = self.get_characters_by(lambda c: isinstance(c, NPC) and c.is_ally())
-        if only_alive:
-            allies = filter(lambda a: not a.is_dead(), allies)
-        return allies
+        return self.get_faction_members(FACTION_ALLY, only_alive)
 
+    @game_command
     def get_enemies(self, only_alive=False):
-        enemies = self.get_characters_by(lambda c: isinstance(c, NPC) and not c.is_ally())
-        if only_alive:
-            enemies = filter(lambda e: not e.is_dead(), enemies)
-        return enemies
+        return self.get_faction_members(FACTION_ENEMY, only_alive)
 
     def get_character(self, character_id):
         if character_id is None:
             return None
         return self._chars.get(character_id, None)
 
+    def get_character_table(self):
+        return self._table
+
     def get_turn(self):
         return self._turn_order
 
-    # TODO: rewrite
-    def get_characters_aoe(self, start_pos, r):
-        pixel_dist = r // OG_METER
-        response = []
-        for c in self._chars:
-            character_pos = c.get_pos()
-            dist = character_pos - start_pos
-            if 0 < dist[0] < 2 and 0 < dist[1] < 2:
-                continue
-            if dist[0] ** 2 + dist[1] ** 2 <= pixel_dist:
-                response += [c]
-        return response
-
-    # TODO: rewrite
-    def get_characters_line(self, start_pos, dest_pos, r, pierce=True):
-        max_dist = r // OG_METER
-        dist = start_pos.distance(dest_pos)
-        if dist > max_dist:
-            dest_pos = start_pos.normalize_distance(dest_pos, max_dist, self.get_map_bounds())
-        response = []
-        first_c = None
-        first_dist = 0
-        for c in self._chars:
-            character_pos = c.get_pos()
-            dist = character_pos - start_pos
-            if 0 < dist[0] < 2 and 0 < dist[1] < 2:
-                continue
-
-            cross = Vector2D.cross_multiply(dist, dest_pos)
-            char_dist = dist.length()
-            if cross > 3 or char_dist > dist:
-                continue
-            if pierce:
-                response += [c]
-            else:
-                if first_c is None:
-                    first_c = c
-                    first_dist = char_dist
-                else:
-                    if first_dist > char_dist:
-                        first_c = c
-                        first_dist = char_dist
-        if not pierce and first_c is not None:
-            response += [first_c]
-        return response
-
+    def get_active_character(self):
+        return self._turn_order.get_active()
+
+    def _targetable_rows_mask(self, exclude=None):
+        # all characters which are not dead, optionally without the given character (e.g. the caster)
+        mask = self._table.mask(status=[STATUS_ALIVE, STATUS_KO])
+        if exclude is not None:
+            row = self._table.row_of(exclude)
+            if row is not None:
+                mask[row] = False
+        return mask
+
+    def get_characters_aoe(self, start_pos, r, exclude=None):
+        # characters within r game meters around start_pos, ordered by distance
+        rows = self._table.rows_within(start_pos, r / OG_METER, self._targetable_rows_mask(exclude))
+        return self._table.characters_at(rows)
+
+    def get_characters_line(self, start_pos, dest_pos, r, pierce=True, width=5, exclude=None):
+        # characters on the line from start_pos towards dest_pos (at most r game meters long),
+        # ordered by distance. without pierce only the first character hit is returned.
+        direction = np.array([dest_pos[0] - start_pos[0], dest_pos[1] - start_pos[1]], dtype=np.float64)
+        length = min(np.hypot(direction[0], direction[1]), r / OG_METER)
+        if length <= 0:
+            return []
+
+        direction /= np.hypot(direction[0], direction[1])
+        relative = self._table.positions - (start_pos[0], start_pos[1])
+        along = relative @ direction
+        across = np.abs(relative[:, 0] * direction[1] - relative[:, 1] * direction[0])
+
+        hits = (along >= 0) & (along <= length) & (across <= (width / OG_METER) / 2)
+        hits &= self._targetable_rows_mask(exclude)
+        rows = np.flatnonzero(hits)
+        rows = rows[np.argsort(np.sqrt(relative[rows, 0] ** 2 + relative[rows, 1] ** 2), kind="stable")]
+        if not pierce:
+            rows = rows[:1]
+
+        return self._table.characters_at(rows)
+
+    def get_characters_cone(self, start_pos, dest_pos, r, angle=60, exclude=None):
+        # characters within r game meters whose direction from start_pos deviates at most angle/2 degrees
+        # from the direction towards dest_pos, ordered by distance
+        direction = np.array([dest_pos[0] - start_pos[0], dest_pos[1] - start_pos[1]], dtype=np.float64)
+        length = np.hypot(direction[0], direction[1])
+        if length <= 0:
+            return []
+
+        direction /= length
+        relative = self._table.positions - (start_pos[0], start_pos[1])
+        dist = np.sqrt(relative[:, 0] ** 2 + relative[:, 1] ** 2)
+        along = relative @ direction
+
+        hits = (dist <= r / OG_METER) & (along >= dist * np.cos(np.radians(angle / 2)))
+        hits &= self._targetable_rows_mask(exclude)
+        rows = np.flatnonzero(hits)
+        rows = rows[np.argsort(dist[rows], kind="stable")]
+        return self._table.characters_at(rows)
+
+    @game_command
     def attack(self, actor: Character, target: Character):
         if not actor.has_action():
             return create_error("No Action Points available")
@@ -206,7 +415,7 @@ class GameController:
 
         weapon = actor.get_active_weapon()
         distance = actor.get_pos().distance(target.get_pos(), factor=1)
-        resp = weapon.attack(distance, target)
+        resp = weapon.attack(distance, target, self._dice)
 
         if resp["success"]:
             actor.use_action()
@@ -215,8 +424,8 @@ class GameController:
 
         return resp
 
+    @game_command
     def move(self, target: Character, pos):
-        print("GameController.move, target:", target, "pos:", pos)
         if target != self._turn_order.get_active():
             return create_error("It's not your characters turn yet")
         if target._stunned > 0:
@@ -224,16 +433,21 @@ class GameController:
         max_dist = target.get_movement_left() / OG_METER
 
         new_pos = target.get_pos().normalize_distance(pos, max_dist / OG_METER, self.get_map_bounds())
-        print("new pos:", new_pos)
+        # obstacles stop the move
+        fraction = self._terrain.clip_line(target.get_pos(), new_pos)
+        if fraction < 1:
+            new_pos = target.get_pos().interpolate(new_pos, fraction)
+        log_event(_move_log, logging.DEBUG, "move", room=self._room, target=target.get_id(), pos=pos, new_pos=new_pos)
         target.move(new_pos)
         return create_response()
 
+    @game_command
     def dash(self, target):
         if not target.has_action():
             return create_error("No action points left")
         if target._stunned > 0:
             return create_error("You are stunned")
-        target._movement_left += target._movement
+        target._movement_left += target.get_movement()
         target.use_action()
         return create_response()
 
@@ -246,7 +460,9 @@ class GameController:
                 with open(config_path, "r") as reader:
                     data = json.loads(reader.read())
                     self._character_configs[config_name] = data
-                    print("Loaded character config:", config_name)
+                    self._character_templates[config_name] = CharacterTemplate.compile(data)
+                    log_event(_config_log, logging.DEBUG, "loaded character config", config=config_name)
+        log_event(_config_log, logging.INFO, "loaded character configs", count=len(self._character_configs))
 
     def get_character_configs(self, fn_filter=None):
         character_configs = self._character_configs
@@ -254,82 +470,427 @@ class GameController:
             character_configs = dict((k, v) for (k, v) in self._character_configs.items() if fn_filter(v))
         return character_configs
 
+    def get_character_template(self, name):
+        return self._character_templates.get(name, None)
+
+    @game_command
     def remove_character(self, character_id):
         if character_id in self._chars:
-            del self._chars[character_id]
-
+            character = self._chars.pop(character_id)
+            self._turn_order.remove(character)
+            self._target_flow_fields.pop(character_id, None)
+            self._members[character.get_faction()].pop(character_id, None)
+            self._spatial_index.remove(character)
+            self._occupancy.remove(character)
+            self._table.remove(character)
+            self._untrack_status(character)
+            self._state_log.mark_removed(character_id)
+            self._targets_version += 1
+            self._invalidate_faction_phase()
+
+    @game_command
     def add_turn(self, character: Character):
         self._turn_order.add(character)
         return create_response()
 
-    def next_turn(self):
-
-        self.mutex.acquire()
+    @game_command
+    def next_turn(self, background=True):
+        # NPC faction phases continue in the background unless background is False, see get_npc_phase
+        if self._npc_phase is not None:
+            return create_error("NPCs are still taking their turns")
 
         # end turn of last char
         active_char = self._turn_order.get_active()
 
-        if active_char is not None:
-            if isinstance(active_char, NPC):
-                is_ally = active_char.is_ally()
-                next_char = active_char
-                while isinstance(next_char, NPC) and is_ally == next_char.is_ally():
-                    next_char.make_turn()
-                    next_char.turn_over()
-                    if self.get_game_state() == "ongoing":
-                        next_char = self._turn_order.get_next()
-                    else:
-                        break
+        if isinstance(active_char, NPC):
+            phase = NPCPhase(active_char.is_ally(), self._count_phase_npcs(active_char))
+            self._npc_phase = phase
+            self._faction_phase = FactionPhase(self)
+            self._event_buffer.begin_batch()
+            self.send_game_event("npcPhaseStarted", {"phase": phase})
+            if background:
+                self._queue_npc_phase_step(phase)
             else:
+                while self._npc_phase_step(phase, False):
+                    pass
+            return create_response({"phase": phase})
+
+        if active_char is not None:
+            with self._event_buffer.batch():
                 active_char.turn_over()
                 self._turn_order.get_next()
 
-        self.mutex.release()
         self.send_game_status()
         return create_response()
 
-    @staticmethod
-    def send_game_event(event, data=None):
+    def _count_phase_npcs(self, active_char):
+        # the active NPC and the NPCs of the same faction directly following it
+        count = 1
+        for character in self._turn_order.preview(len(self._turn_order)):
+            if not isinstance(character, NPC) or character.is_ally() != active_char.is_ally():
+                break
+            count += 1
+        return count
+
+    def _npc_phase_step(self, phase, background):
+        # the active NPC takes its turn. in the background, the next step is queued behind the commands
+        # that arrived in the meantime. returns whether the phase continues
+        try:
+            continues = False
+            if not phase.is_cancelled():
+                npc = self._turn_order.get_active()
+                npc.make_turn()
+                npc.turn_over()
+                phase.step()
+                self.send_game_event("npcPhaseProgress", {"phase": phase, "characterId": npc.get_id()})
+                if self.get_game_state() == "ongoing":
+                    next_char = self._turn_order.get_next()
+                    continues = isinstance(next_char, NPC) and next_char.is_ally() == npc.is_ally()
+        except BaseException:
+            self._finish_npc_phase(phase)
+            raise
+
+        if not continues:
+            self._finish_npc_phase(phase)
+        elif background:
+            self._queue_npc_phase_step(phase)
+        return continues
+
+    def _queue_npc_phase_step(self, phase):
+        # failures of a step are logged by the command queue, a closed game ends the phase without running it
+        try:
+            future = self._commands.submit("GameController._npc_phase_step", self._npc_phase_step, phase, True)
+        except CommandQueueStopped:
+            self._finish_npc_phase(phase)
+            return
+        future.add_done_callback(lambda f: self._on_npc_phase_step_done(phase, f))
+
+    def _on_npc_phase_step_done(self, phase, future):
+        if isinstance(future.exception(), CommandQueueStopped):
+            self._finish_npc_phase(phase)
+
+    def _finish_npc_phase(self, phase):
+        self._faction_phase = None
+        self._npc_phase = None
+        phase.finish()
+        self.send_game_event("npcPhaseFinished", {"phase": phase})
+        self._event_buffer.end_batch()
+        self.send_game_status()
+
+    @game_command
+    def send_game_event(self, event, data=None):
+        if self._headless:
+            return
         data = {} if data is None else data
         data["type"] = event
         data["timestamp"] = int(time.time())
-        emit("gameEvent", json_serialize(data), broadcast=True)
-        print("Game Event:", data)
+        data = json_serialize(data)
+        self._event_buffer.push(data)
+        log_event(_event_log, logging.DEBUG, "game event", room=self._room, event=data)
+
+    @game_command
+    def flush_game_events(self):
+        self._event_buffer.flush()
+
+    def _emit_game_events(self, events):
+        self._broadcast("gameEvents", {"events": events}, self._room)
 
     def send_game_status(self):
-        emit("gameStatus", self.get_status(), broadcast=True)
+        # headless games have nobody to send it to, building it would commit the state log every turn
+        if self._headless:
+            return
+        self._broadcast("gameStatus", self.get_status(), self._room)
+
+    def close(self):
+        # the game was replaced or removed: stop its NPC phase, nothing is broadcast to the room anymore
+        self._broadcast = _no_broadcast
+        if self._npc_phase is not None:
+            self._npc_phase.cancel()
+        self._commands.stop()
+
+    def get_command_queue(self):
+        return self._commands
+
+    def get_command_stats(self):
+        return self._commands.get_stats()
+
+    def get_npc_phase(self):
+        return self._npc_phase
+
+    def is_npc_phase_running(self):
+        return self._npc_phase is not None
+
+    def cancel_npc_phase(self):
+        phase = self._npc_phase
+        if phase is None:
+            return create_error("No NPC phase running")
+        phase.cancel()
+        return create_response({"phase": phase})
+
+    def _track_status(self, character: Character):
+        # keep the per-faction alive/ko/dead counters in sync with the status of character
+        old_status = self._tracked_status.get(character.get_id(), None)
+        new_status = character.get_status()
+        if old_status != new_status:
+            counts = self._status_counts[character.get_faction()]
+            if old_status is not None:
+                counts[old_status] -= 1
+            counts[new_status] += 1
+            self._tracked_status[character.get_id()] = new_status
+            self._update_alive_members(character, old_status, new_status)
+
+    def _update_alive_members(self, character: Character, old_status, new_status):
+        alive_members = self._alive_members[character.get_faction()]
+        if new_status == "dead":
+            alive_members.pop(character.get_id(), None)
+        elif old_status is None:
+            alive_members[character.get_id()] = character
+        elif old_status == "dead":
+            # revived, re-insert while keeping roster order
+            alive_members[character.get_id()] = character
+            alive_members_sorted = sorted(alive_members.items())
+            alive_members.clear()
+            alive_members.update(alive_members_sorted)
+
+    def _untrack_status(self, character: Character):
+        old_status = self._tracked_status.pop(character.get_id(), None)
+        if old_status is not None:
+            self._status_counts[character.get_faction()][old_status] -= 1
+        self._alive_members[character.get_faction()].pop(character.get_id(), None)
+
+    def _is_in_game(self, character: Character):
+        # removed characters may still be mutated by handlers holding them, they are no longer tracked
+        return self._chars.get(character.get_id(), None) is character
+
+    def on_character_changed(self, character: Character):
+        if not self._is_in_game(character):
+            return
+        self._table.update(character)
+        self._track_status(character)
+        self._state_log.mark_changed(character)
+
+    def on_character_moved(self, character: Character, old_pos):
+        if not self._is_in_game(character):
+            return
+        self._spatial_index.update(character)
+        self._occupancy.update(character)
+        self._table.update_pos(character)
+        self._state_log.mark_changed(character)
+        self._targets_version += 1
+        if self._faction_phase is not None:
+            self._faction_phase.on_character_moved(character, old_pos)
+
+    def on_character_revived(self, character: Character):
+        if not self._is_in_game(character):
+            return
+        self._table.update(character)
+        self._track_status(character)
+        self._state_log.mark_changed(character)
+        self._targets_version += 1
+        if character not in self._spatial_index:
+            self._spatial_index.insert(character)
+            self._occupancy.insert(character)
+            self._invalidate_faction_phase()
 
     def on_character_died(self, character: Character, reason=None):
+        if not self._is_in_game(character):
+            return
         self._turn_order.remove(character)
+        self._target_flow_fields.pop(character.get_id(), None)
+        self._table.update(character)
+        self._track_status(character)
+        self._state_log.mark_changed(character)
+        self._targets_version += 1
+        self._occupancy.remove(character)
+        if character in self._spatial_index:
+            self._spatial_index.remove(character)
+            if self._faction_phase is not None:
+                self._faction_phase.on_character_died(character)
         self.send_game_event("characterDied", {"characterId": character.get_id(), "reason": reason})
 
-    @classmethod
-    def instance(cls):
-        if cls._instance is None:
-            cls._instance = GameController()
-        return cls._instance
+    def get_status_counts(self, faction):
+        return self._status_counts[faction]
 
-    @classmethod
-    def reset(cls):
-        cls._instance = None
+    def _count_not_dead(self, faction):
+        counts = self._status_counts[faction]
+        return counts["alive"] + counts["ko"]
 
     def get_game_state(self):
-        if not any(self.get_enemies(only_alive=True)):
+        if self._count_not_dead(FACTION_ENEMY) == 0:
             return "won"
-        elif not any(self.get_allies(only_alive=True)) and not any(self.get_player_characters(only_alive=True)):
+        elif self._count_not_dead(FACTION_ALLY) == 0 and self._count_not_dead(FACTION_PLAYER) == 0:
             return "lost"
         else:
             return "ongoing"
 
+    @game_command
     def get_status(self):
         return {
             "round": self._turn_order.get_round(),
+            "seq": self._state_log.commit(),
             "active_char": None if not self._turn_order.get_active() else self._turn_order.get_active().get_id(),
+            "upcoming": [c.get_id() for c in self._turn_order.preview(self.TURN_PREVIEW_SIZE)],
             "state": self.get_game_state(),
+            "factions": dict((name, self._status_counts[faction].copy()) for faction, name in FACTION_NAMES.items()),
+            "phase": self._npc_phase,
             "map": {
                 "bounds": self.get_map_bounds(),
+                "terrain": self._terrain.get_version(),
             }
         }
 
     def get_map_bounds(self):
         return [0, 0, self._map_size._x - 1, self._map_size._y - 1]
+
+    def get_terrain(self):
+        return self._terrain
+
+    @game_command
+    def get_terrain_json(self):
+        return self._terrain.to_json()
+
+    @game_command
+    def set_terrain(self, min_pos, max_pos, cost=None):
+        # cost None turns the rectangle into an obstacle, 1 clears it
+        if cost is None:
+            cost = OBSTACLE_COST
+        elif not isinstance(cost, (int, float)) or isinstance(cost, bool) or not cost >= OPEN_COST:
+            return create_error(f"Invalid terrain cost: {cost}, it has to be a number of at least {OPEN_COST:g}")
+
+        cells = self._terrain.set_cost(min_pos, max_pos, cost)
+        log_event(_log, logging.INFO, "terrain changed", room=self._room, min=min_pos, max=max_pos, cost=cost,
+                  cells=cells)
+
+        # characters standing on a new obstacle are moved next to it
+        if cost == OBSTACLE_COST:
+            for character in list(self._chars.values()):
+                if self._terrain.is_blocked(character.get_pos()):
+                    character.place(Position(*self._terrain.nearest_open(character.get_pos())), force=True)
+
+        terrain = self._terrain.to_json()
+        self.send_game_event("terrainChanged", terrain)
+        return create_response(data=terrain)
+
+    def resolve_position(self, character, pos, target=None, reach=None):
+        # pos, or a free slot close to it if other tokens cover it. when approaching target the slot stays
+        # within reach (pixels) of it, otherwise or if there is none it is the last one on the way to pos
+        if character not in self._occupancy:
+            return pos
+        start = character.get_pos()
+        fraction = self._occupancy.resolve(character, start, pos)
+        if fraction == 1:
+            return pos
+        if target is not None:
+            slot = self._find_slot_in_reach(character, pos, target, reach)
+            if slot is not None:
+                return slot
+        resolved = start if fraction == 0 else start.interpolate(pos, fraction)
+        # moves along the flow field bend around obstacles, stepping back in a straight line may end inside one
+        if self._terrain.is_blocked(resolved):
+            return start
+        return resolved
+
+    def _find_slot_in_reach(self, character, pos, target, reach):
+        # free slot around target within reach, closest to pos, the character can walk to it this turn
+        start_x, start_y = character.get_pos()[0], character.get_pos()[1]
+        bounds = self.get_map_bounds()
+        movement = character.get_movement_left() / (OG_METER * OG_METER)
+        if character.distance(target) - reach > movement:
+            # out of reach this turn anyway
+            return None
+
+        def accept(x, y):
+            if not (bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]):
+                return False
+            if (x - start_x) ** 2 + (y - start_y) ** 2 > movement ** 2:
+                return False
+            return self._terrain.is_open() or \
+                (not self._terrain.is_blocked((x, y)) and self._terrain.clip_line(pos, (x, y)) == 1)
+
+        # the attack range is checked against the exact distance, stay a bit inside of it
+        min_distance = character.get_token_radius() + target.get_token_radius()
+        slot = self._occupancy.find_slot(character, target.get_pos(), min_distance, reach - 0.01, pos, accept)
+        return None if slot is None else Position(*slot)
+
+    def get_path_flow_field(self, character, target):
+        # the shared field of the faction if it leads from character to target, otherwise a field towards target
+        field = self.get_flow_field(character.get_faction())
+        target_cell = self._terrain.cell_of(target.get_pos())
+        if field.leads_to(character.get_pos(), target_cell):
+            return field
+
+        target_field = self._target_flow_fields.get(target.get_id(), None)
+        if target_field is None:
+            target_field = self._target_flow_fields[target.get_id()] = FlowField(self._terrain)
+        target_field.update([target_cell])
+        return target_field
+
+    def get_flow_field(self, faction):
+        # flow field towards all not dead characters hostile to the faction, shared by the whole faction
+        target_factions = HOSTILE_FACTIONS[faction]
+        field, version = self._flow_fields.get(target_factions, (None, None))
+        if field is None:
+            field = FlowField(self._terrain)
+
+        current_version = (self._targets_version, self._terrain.get_version())
+        if version != current_version:
+            mask = self._table.mask(target_factions, [STATUS_ALIVE, STATUS_KO])
+            rows, columns = self._terrain.cells_of(self._table.positions[mask])
+            field.update(zip(rows.tolist(), columns.tolist()))
+            self._flow_fields[target_factions] = (field, current_version)
+        return field
+
+
+class GameRegistry:
+
+    """All running games of this process, keyed by their socket.io room."""
+
+    DEFAULT_ROOM = "default"
+
+    def __init__(self, broadcast=None):
+        self._games = {}
+        self._lock = Lock()
+        self._broadcast = broadcast
+
+    def get(self, room=DEFAULT_ROOM):
+        game = self._games.get(room, None)
+        if game is None:
+            with self._lock:
+                game = self._games.get(room, None)
+                if game is None:
+                    game = GameController(room, broadcast=self._broadcast)
+                    self._games[room] = game
+        return game
+
+    def reset(self, room=DEFAULT_ROOM):
+        # character ids are stored in client sessions, continue counting to not re-use them
+        with self._lock:
+            old_game = self._games.get(room, None)
+            first_character_id = 1
+            if old_game is not None:
+                old_game.close()
+                first_character_id = old_game.next_char_id()
+            self._games[room] = GameController(room, first_character_id, self._broadcast)
+            return self._games[room]
+
+    def remove(self, room):
+        with self._lock:
+            game = self._games.pop(room, None)
+            if game is not None:
+                game.close()
+
+    def get_rooms(self):
+        return list(self._games.keys())
+
+
+game_registry = GameRegistry()
+
+
+def get_game_registry():
+    return game_registry
+
+
+def set_game_registry(registry):
+    # e.g. a ShardedGameRegistry, when the games of this process run in shard worker processes
+    global game_registry
+    game_registry = registry
@@ -1,10 +1,13 @@
+import json
+import time
 from abc import ABC, abstractmethod
 from functools import update_wrapper
 
-from flask import session, request
-from flask_socketio import emit
+import flask_socketio
+from flask import session, request, g, has_request_context
 
 from utils.json_serializable import JsonSerializable
+from utils.metrics import get_metrics
 
 
 def json_serialize(data):
@@ -17,7 +20,7 @@ def json_serialize(data):
         for i, value in enumerate(data):
             data[i] = json_serialize(value)
     elif isinstance(data, JsonSerializable):
-        return json_serialize(data.to_json())
+        return data.serialize()
 
     return data
 
@@ -31,11 +34,44 @@ def create_error(msg=""):
     return create_response(success=False, msg=msg)
 
 
+def get_current_game():
+    # game of the room the requesting client joined
+    from gamecontroller import get_game_registry
+    game_registry = get_game_registry()
+    return game_registry.get(session.get("game", game_registry.DEFAULT_ROOM))
+
+
 def broadcast_response(response):
     event = request.event["message"]
     emit(event, response)
     if response["success"]:
-        emit(event, response["data"], broadcast=True, include_self=False)
+        emit(event, response["data"], to=get_current_game().get_room(), include_self=False)
+
+
+def emit(event, *args, **kwargs):
+    # flask_socketio.emit, noting error responses of the handled event for its metrics (see instrumented)
+    if args and isinstance(args[0], dict) and args[0].get("success", None) is False and has_request_context():
+        g.api_error = True
+    return flask_socketio.emit(event, *args, **kwargs)
+
+
+def instrumented():
+    # records latency, errors (raised or responded) and payload size of every call of a socket event handler
+    def decorator(fn):
+        def wrapped_function(*args, **kwargs):
+            event = request.event['message']
+            payload = len(json.dumps(args[0], default=str)) if args else 0
+            started, failed = time.perf_counter(), True
+            try:
+                result = fn(*args, **kwargs)
+                failed = g.get("api_error", False)
+                return result
+            finally:
+                get_metrics().record("socket_event", event, time.perf_counter() - started, failed, payload=payload)
+
+        return update_wrapper(wrapped_function, fn)
+
+    return decorator
 
 
 def has_character():
@@ -51,6 +87,20 @@ def has_character():
     return decorator
 
 
+def no_npc_phase():
+    # rejects commands changing the game while its NPCs take their turns in the background
+    def decorator(fn):
+        def wrapped_function(*args, **kwargs):
+            if get_current_game().is_npc_phase_running():
+                return emit(request.event['message'], create_error("NPCs are still taking their turns"))
+
+            return fn(*args, **kwargs)
+
+        return update_wrapper(wrapped_function, fn)
+
+    return decorator
+
+
 def has_role(*required_roles):
     def decorator(fn):
         def wrapped_function(*args, **kwargs):
@@ -84,8 +134,7 @@ def param(param_name, required_type=None, optional=False, default=None):
             elif required_type is not None:
                 value = data[param_name]
                 if issubclass(required_type, ApiParameter):
-                    from gamecontroller import GameController
-                    res = required_type.api_validate(GameController.instance(), value)
+                    res = required_type.api_validate(get_current_game(), value)
                     if isinstance(res, dict) and res.get("success", None) is False:
                         res["msg"] = f"Error validating parameter '{param_name}': " + res["msg"]
                         emit(event, res)
@@ -110,6 +159,8 @@ def param(param_name, required_type=None, optional=False, default=None):
 
 
 class ApiParameter(ABC):
+    __slots__ = ()
+
     @staticmethod
     @abstractmethod
     def api_validate(game_controller, value):
@@ -0,0 +1,203 @@
+import numpy as np
+
+from utils.constants import STATUS_ALIVE, STATUS_KO, STATUS_DEAD
+
+
+class CharacterTable:
+
+    """Structure-of-arrays copy of the combat relevant state of all characters of a game.
+
+    Every character owns one row. The Character objects stay the source of truth and write
+    through to their row on every mutation, so the arrays can be used for vectorized queries.
+    """
+
+    def __init__(self, capacity=64):
+        self._size = 0
+        self._rows = {}
+        self._characters = []
+
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._pos = np.zeros((capacity, 2), dtype=np.float64)
+        self._hp = np.zeros(capacity, dtype=np.int64)
+        self._max_hp = np.zeros(capacity, dtype=np.int64)
+        self._armor = np.zeros(capacity, dtype=np.int64)
+        self._faction = np.zeros(capacity, dtype=np.int8)
+        self._status = np.zeros(capacity, dtype=np.int8)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, character):
+        return character.get_id() in self._rows
+
+    def _grow(self):
+        capacity = max(1, len(self._ids) * 2)
+        for name in ["_ids", "_pos", "_hp", "_max_hp", "_armor", "_faction", "_status"]:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, character):
+        if character in self:
+            self.update(character)
+            return self._rows[character.get_id()]
+
+        if self._size == len(self._ids):
+            self._grow()
+
+        row = self._size
+        self._size += 1
+        self._rows[character.get_id()] = row
+        self._characters.append(character)
+        self._ids[row] = character.get_id()
+        self._faction[row] = character.get_faction()
+        self.update(character)
+        return row
+
+    def add_many(self, characters):
+        # appends the rows of new characters at once, characters already in the table are updated
+        new_characters = []
+        for character in characters:
+            if character in self:
+                self.update(character)
+            else:
+                new_characters.append(character)
+        if not new_characters:
+            return
+
+        while self._size + len(new_characters) > len(self._ids):
+            self._grow()
+
+        rows = slice(self._size, self._size + len(new_characters))
+        ids = [character.get_id() for character in new_characters]
+        self._rows.update(zip(ids, range(rows.start, rows.stop)))
+        self._characters.extend(new_characters)
+        self._size = rows.stop
+
+        self._ids[rows] = ids
+        self._pos[rows] = [(character.get_pos()[0], character.get_pos()[1]) for character in new_characters]
+        self._hp[rows] = [character.get_hp() for character in new_characters]
+        self._max_hp[rows] = [character.get_max_hp() for character in new_characters]
+        self._armor[rows] = [character.get_armor() for character in new_characters]
+        self._faction[rows] = [character.get_faction() for character in new_characters]
+        self._status[rows] = [self._status_of(character) for character in new_characters]
+
+    def remove(self, character):
+        row = self._rows.pop(character.get_id(), None)
+        if row is None:
+            return
+
+        # move the last row into the gap to keep the arrays contiguous
+        last = self._size - 1
+        if row != last:
+            moved = self._characters[last]
+            self._characters[row] = moved
+            self._rows[moved.get_id()] = row
+            for array in [self._ids, self._pos, self._hp, self._max_hp, self._armor, self._faction, self._status]:
+                array[row] = array[last]
+
+        self._characters.pop()
+        self._size -= 1
+
+    def update_pos(self, character):
+        row = self._rows.get(character.get_id(), None)
+        if row is not None:
+            pos = character.get_pos()
+            self._pos[row, 0] = pos[0]
+            self._pos[row, 1] = pos[1]
+
+    def update(self, character):
+        row = self._rows.get(character.get_id(), None)
+        if row is None:
+            return
+
+        pos = character.get_pos()
+        self._pos[row, 0] = pos[0]
+        self._pos[row, 1] = pos[1]
+        self._hp[row] = character.get_hp()
+        self._max_hp[row] = character.get_max_hp()
+        self._armor[row] = character.get_armor()
+        self._status[row] = self._status_of(character)
+
+    @staticmethod
+    def _status_of(character):
+        if character.is_dead():
+            return STATUS_DEAD
+        elif character.get_hp() <= 0:
+            return STATUS_KO
+        return STATUS_ALIVE
+
+    def clear(self):
+        self._size = 0
+        self._rows = {}
+        self._characters = []
+
+    # array views, only valid until the next add/remove
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def positions(self):
+        return self._pos[:self._size]
+
+    @property
+    def hp(self):
+        return self._hp[:self._size]
+
+    @property
+    def max_hp(self):
+        return self._max_hp[:self._size]
+
+    @property
+    def armor(self):
+        return self._armor[:self._size]
+
+    @property
+    def factions(self):
+        return self._faction[:self._size]
+
+    @property
+    def status(self):
+        return self._status[:self._size]
+
+    def row_of(self, character):
+        return self._rows.get(character.get_id(), None)
+
+    def character_at(self, row):
+        return self._characters[row]
+
+    def characters_at(self, rows):
+        return [self._characters[row] for row in rows]
+
+    def mask(self, factions=None, status=None):
+        # boolean row mask, factions/status may be a single code or a list of codes
+        mask = np.ones(self._size, dtype=bool)
+        if factions is not None:
+            mask &= np.isin(self.factions, factions)
+        if status is not None:
+            mask &= np.isin(self.status, status)
+        return mask
+
+    def count(self, factions=None, status=None):
+        return int(np.count_nonzero(self.mask(factions, status)))
+
+    def distances_from(self, pos):
+        delta = self.positions - (pos[0], pos[1])
+        return np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2)
+
+    def distance_matrix(self, rows_a=None, rows_b=None):
+        a = self.positions if rows_a is None else self.positions[rows_a]
+        b = self.positions if rows_b is None else self.positions[rows_b]
+        delta = a[:, np.newaxis, :] - b[np.newaxis, :, :]
+        return np.sqrt(delta[..., 0] ** 2 + delta[..., 1] ** 2)
+
+    def rows_within(self, pos, radius, mask=None):
+        # rows within radius of pos, ordered by distance
+        dist = self.distances_from(pos)
+        hits = dist <= radius
+        if mask is not None:
+            hits &= mask
+        rows = np.flatnonzero(hits)
+        return rows[np.argsort(dist[rows], kind="stable")]
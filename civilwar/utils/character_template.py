@@ -0,0 +1,57 @@
+from typing import NamedTuple, Optional, Tuple
+
+from utils.constants import MEELE_RANGE, TOKEN_RADIUS
+
+
+class WeaponDefinition(NamedTuple):
+
+    """Immutable stats of a weapon config, shared by all Weapon instances of a character template."""
+
+    name: str
+    hit: int
+    dices: int
+    dice_type: int
+    type: str
+    additional: int = 0
+    min_range: float = 0
+    max_range: float = MEELE_RANGE
+    usages: int = -1
+
+    @staticmethod
+    def compile(dictionary):
+        return WeaponDefinition(dictionary["name"], dictionary["hit"], dictionary["dices"], dictionary["diceType"],
+                                dictionary["type"], dictionary.get("additional", 0), dictionary.get("minRange", 0),
+                                dictionary.get("maxRange", MEELE_RANGE), dictionary.get("usages", -1))
+
+
+class CharacterTemplate(NamedTuple):
+
+    """Immutable, pre-parsed character config. Characters keep only their mutable state themselves."""
+
+    name: str
+    type: str
+    life_points: int
+    armor_class: int
+    movement: float
+    passive_perception: int
+    weapons: Tuple[WeaponDefinition, ...]
+    active_weapon: str
+    resistances: Tuple[str, ...] = ()
+    token: str = ""
+    token_shadow: Optional[str] = None
+    spells: tuple = ()
+    spell_slots: tuple = ()
+    multi_attack: bool = False
+    initiative: int = 0
+    token_radius: float = TOKEN_RADIUS
+
+    @staticmethod
+    def compile(dictionary):
+        return CharacterTemplate(
+            dictionary.get("name", ""), dictionary.get("type", "npc"), dictionary["lifePoints"],
+            dictionary["armorClass"], dictionary["movement"], dictionary["passivePerception"],
+            tuple(WeaponDefinition.compile(weapon_data) for weapon_data in dictionary["weapons"]),
+            dictionary["activeWeapon"], tuple(dictionary.get("resistance", [])), dictionary.get("token", ""),
+            dictionary.get("tokenShadow", None), tuple(dictionary.get("spells", [])),
+            tuple(dictionary.get("spellSlots", [])), dictionary.get("multiAttack", False),
+            dictionary.get("initiative", 0), dictionary.get("tokenRadius", TOKEN_RADIUS))
@@ -1,8 +1,9 @@
-import random
 from abc import abstractmethod, ABC
 
 from utils.api import create_error, ApiParameter, create_response
 from utils.character_stats import CharacterStats
+from utils.character_template import CharacterTemplate
+from utils.command_queue import game_command
 from utils.constants import MEELE_RANGE, OG_METER
 from utils.json_serializable import JsonSerializable
 from utils.position import Position
@@ -12,21 +13,23 @@ from utils.weapon import Weapon
 
 class Character(JsonSerializable, ApiParameter, ABC):
 
-    def __init__(self, character_id, dictionary, pos=Position(0, 0)):
+    __slots__ = ["_template", "_id", "_max_life", "_curr_life", "_armor", "_movement_left", "_weapons",
+                 "_active_weapon", "_resistances", "_res_buff", "_pos", "_action_points", "_action_points_max",
+                 "_ap_buff", "_stunned", "_death_advantage", "_dead", "_won_death", "_lost_death",
+                 "_available_slots", "_prev_stats", "_game", "_json_cache"]
+
+    def __init__(self, character_id, template: CharacterTemplate, pos=Position(0, 0)):
+        # immutable stats shared by all characters of a config, the attributes below are this character's state
+        self._template = template
         self._id = character_id
-        self._max_life = dictionary["lifePoints"]
-        self._curr_life = dictionary["lifePoints"]
-        self._armor = dictionary["armorClass"]
-        self._movement = dictionary["movement"]
-        self._movement_left = dictionary["movement"]
-        self._passivePerception = dictionary["passivePerception"]
-        self._weapons = [Weapon(weapon_data) for weapon_data in dictionary["weapons"]]
-        self._active_weapon = self.get_weapon(dictionary["activeWeapon"])
-        self._resistances = dictionary.get("resistance", [])
-        self._std_resistances = dictionary.get("resistance", [])
+        self._max_life = template.life_points
+        self._curr_life = template.life_points
+        self._armor = template.armor_class
+        self._movement_left = template.movement
+        self._weapons = [Weapon(definition) for definition in template.weapons]
+        self._active_weapon = self.get_weapon(template.active_weapon)
+        self._resistances = template.resistances
         self._res_buff = 0
-        self._token = dictionary.get("token", "")
-        self._token_shadow = dictionary.get("tokenShadow", None)
         self._pos = pos
         self._action_points = 1
         self._action_points_max = 1
@@ -36,19 +39,30 @@ class Character(JsonSerializable, ApiParameter, ABC):
         self._dead = False
         self._won_death = 0
         self._lost_death = 0
-        self._spells = dictionary.get("spells", [])
-        self._spell_slots = dictionary.get("spellSlots", [])
-        self._available_slots = dictionary.get("spellSlots", [])
+        self._available_slots = template.spell_slots
 
         self._prev_stats = None
 
+        # game controller this character belongs to, set when it is added to a game
+        self._game = None
+
+        # cached serialized form, reset whenever serialized state changes
+        self._json_cache = None
+
     @abstractmethod
     def get_name(self):
         pass
 
+    @abstractmethod
+    def get_faction(self):
+        pass
+
     def get_hp(self):
         return self._curr_life
 
+    def get_max_hp(self):
+        return self._max_life
+
     def get_armor(self):
         return self._armor
 
@@ -58,9 +72,18 @@ class Character(JsonSerializable, ApiParameter, ABC):
     def get_pos(self):
         return self._pos
 
+    def get_movement(self):
+        return self._template.movement
+
     def get_movement_left(self):
         return self._movement_left
 
+    def get_template(self):
+        return self._template
+
+    def get_token_radius(self):
+        return self._template.token_radius
+
     def save_roll(self, attribute: str):
         pass
 
@@ -76,6 +99,10 @@ class Character(JsonSerializable, ApiParameter, ABC):
         self._action_points -= 1
         return True
 
+    def is_stunned(self):
+        return self._stunned > 0
+
+    @game_command
     def stun(self, rounds):
         self._stunned += rounds
         self.send_character_event("characterStunned", {"rounds": rounds})
@@ -87,6 +114,7 @@ class Character(JsonSerializable, ApiParameter, ABC):
         except StopIteration:
             return None
 
+    @game_command
     def switch_weapon(self, weapon):
         if weapon not in self._weapons:
             return create_error("You do not own such weapon")
@@ -95,11 +123,22 @@ class Character(JsonSerializable, ApiParameter, ABC):
 
         self._active_weapon = weapon
         self.use_action()
+        self._on_changed()
         self.send_character_event("characterSwitchWeapon", {"weapon": weapon.get_name()})
         return create_response()
 
+    @game_command
+    def switch_weapon_by_name(self, name):
+        # weapons never leave the game's process, remote callers (shards) switch by name
+        weapon = self.get_weapon(name)
+        if weapon is None:
+            return create_error("You do not own such weapon")
+        return self.switch_weapon(weapon)
+
+    @game_command
     def change_health(self, health):
         self._curr_life = clamp(self._curr_life + health, -self._max_life, self._max_life)
+        self._on_changed()
         if self._curr_life <= 0:
             if self.is_transformed():
                 self.retransform()
@@ -109,20 +148,44 @@ class Character(JsonSerializable, ApiParameter, ABC):
             else:
                 self.send_character_event("characterKO", {})
 
-    def move(self, new_pos):
+    def move(self, new_pos, target=None, reach=None):
+        # if other tokens cover new_pos, the token stops at a free slot within reach (pixels) of target,
+        # or short of new_pos without a target
+        new_pos = self._game.resolve_position(self, new_pos, target, reach)
+        if new_pos is self._pos:
+            # blocked right away, nothing moved
+            return create_response()
         dist = self._pos.distance(new_pos)
-        self._pos = new_pos
+        self._set_pos(new_pos)
         self._movement_left = max(0, (self._movement_left / (OG_METER*OG_METER)) - dist) * (OG_METER*OG_METER)
         self.send_character_event("characterMove", {"to": self._pos, "movementLeft": self._movement_left})
         return create_response()
 
-    def place(self, new_pos: Position):
-        from gamecontroller import GameController
-        bounded_pos = new_pos.to_bounds(GameController.instance().get_map_bounds())
-        self._pos = bounded_pos
+    @game_command
+    def place(self, new_pos: Position, force=False):
+        # force skips the other tokens, overlaps are then resolved by the next move
+        bounded_pos = new_pos.to_bounds(self._game.get_map_bounds())
+        if not force:
+            bounded_pos = self._game.resolve_position(self, bounded_pos)
+        if self._game.get_terrain().is_blocked(bounded_pos):
+            return create_error("Characters can not be placed on obstacles")
+        self._set_pos(bounded_pos)
         self.send_character_event("characterPlace", {"to": self._pos})
         return create_response()
 
+    def _mark_dirty(self):
+        self._json_cache = None
+
+    def _on_changed(self):
+        self._mark_dirty()
+        self._game.on_character_changed(self)
+
+    def _set_pos(self, new_pos):
+        old_pos = self._pos
+        self._pos = new_pos
+        self._mark_dirty()
+        self._game.on_character_moved(self, old_pos)
+
     def get_status(self):
         if self.is_dead():
             return "dead"
@@ -135,7 +198,7 @@ class Character(JsonSerializable, ApiParameter, ABC):
         data = {
             "id": self._id,
             "name": self.get_name(),
-            "token": self._token,
+            "token": self._template.token,
             "pos": self._pos,
             "status": self.get_status(),
             "hp": self.get_hp(),
@@ -144,14 +207,28 @@ class Character(JsonSerializable, ApiParameter, ABC):
             "weapons": [w.get_name() for w in self._weapons]
         }
 
-        if self._token_shadow:
-            data["tokenShadow"] = self._token_shadow
+        if self._template.token_shadow:
+            data["tokenShadow"] = self._template.token_shadow
 
         return data
 
+    def serialize(self):
+        if self._json_cache is None:
+            self._json_cache = super().serialize()
+        return self._json_cache
+
     def get_id(self):
         return self._id
 
+    def get_game(self):
+        return self._game
+
+    def set_game(self, game):
+        self._game = game
+
+    def get_command_queue(self):
+        return self._game.get_command_queue()
+
     def turn_over(self):
         if self.is_dead():
             return
@@ -159,7 +236,7 @@ class Character(JsonSerializable, ApiParameter, ABC):
             self._death_roll()
             return
 
-        self._movement_left = self._movement
+        self._movement_left = self._template.movement
         self._action_points = self._action_points_max
         if self._ap_buff > 0:
             self._ap_buff -= 1
@@ -168,7 +245,7 @@ class Character(JsonSerializable, ApiParameter, ABC):
         if self._res_buff > 0:
             self._res_buff -= 1
             if self._res_buff == 0:
-                self._resistances = self._std_resistances.copy()
+                self._resistances = self._template.resistances
         if self._stunned > 0:
             self._stunned -= 1
 
@@ -176,9 +253,10 @@ class Character(JsonSerializable, ApiParameter, ABC):
         pass
 
     def _death_roll(self):
-        roll = random.randint(1, 20)
+        dice = self._game.get_dice()
+        roll = dice.d(20)
         if self._death_advantage:
-            roll = max(roll, random.randint(1, 20))
+            roll = max(roll, dice.d(20))
         self.on_death_roll(roll)
         if roll > 10:
             if roll == 20:
@@ -186,7 +264,7 @@ class Character(JsonSerializable, ApiParameter, ABC):
             else:
                 self._won_death += 1
                 if self._won_death >= 3:
-                    self.revive(random.randint(1, 4), "Won 3 Death roles")
+                    self.revive(dice.d(4), "Won 3 Death roles")
         else:
             self._lost_death += 1
             if roll == 1:
@@ -200,16 +278,19 @@ class Character(JsonSerializable, ApiParameter, ABC):
     def is_ko(self):
         return (not self.is_dead()) and self._curr_life <= 0
 
+    @game_command
     def kill(self, reason=None):
         self._dead = True
-        from gamecontroller import GameController
-        GameController.instance().on_character_died(self, reason=reason)
+        self._mark_dirty()
+        self._game.on_character_died(self, reason=reason)
 
     def revive(self, hp=1, reason=None):
         self._won_death = 0
         self._lost_death = 0
         self._curr_life = hp
         self._dead = False
+        self._mark_dirty()
+        self._game.on_character_revived(self)
         self.send_character_event("characterSurvived", data={"reason": reason, "hp": self.get_hp()})
 
     @staticmethod
@@ -224,32 +305,13 @@ class Character(JsonSerializable, ApiParameter, ABC):
         return character
 
     def get_enemies_with_distance(self, distance=MEELE_RANGE/OG_METER):
-        from gamecontroller import GameController
-        game_controller = GameController.instance()
-        filters = [
-            lambda c: not c.is_dead(),  # character is alive
-            lambda c: self.distance(c) <= distance,  # in range
-            lambda c: not self.is_allied_to(c),  # is not allied to
-        ]
-
-        return game_controller.get_characters_by(*filters)
+        return self._game.get_characters_in_radius(self.get_pos(), distance,
+                                                   lambda c: not c.is_dead(),  # character is alive
+                                                   lambda c: not self.is_allied_to(c))  # is not allied to
 
     def get_closest_enemy(self):
-        from gamecontroller import GameController
-        game_controller = GameController.instance()
-        enemies = list(game_controller.get_characters_by(lambda c: not c.is_dead() and not self.is_allied_to(c)))
-        if len(enemies) == 0:
-            return None
-
-        closest_enemy = enemies[0]
-        closest_dist = self.distance(closest_enemy)
-        for enemy in enemies:
-            dist = self.distance(enemy)
-            if dist < closest_dist:
-                closest_enemy = enemy
-                closest_dist = dist
-
-        return closest_enemy
+        return self._game.get_closest_character(self.get_pos(),
+                                                lambda c: not c.is_dead() and not self.is_allied_to(c))
 
     @abstractmethod
     def is_allied_to(self, other):
@@ -259,14 +321,18 @@ class Character(JsonSerializable, ApiParameter, ABC):
         return self.get_pos().distance(other.get_pos(), factor)
 
     def move_towards(self, other, requested_distance):
-        from gamecontroller import GameController
-        game_controller = GameController.instance()
         current_distance = self.distance(other)
         move_distance = min(current_distance - requested_distance, self._movement_left / OG_METER)
         if move_distance > 0:
-            target_pos = self.get_pos().normalize_distance(other.get_pos(), move_distance / OG_METER,
-                                                           game_controller.get_map_bounds())
-            self.move(target_pos)
+            pos, goal = self.get_pos(), other.get_pos()
+            if self._game.get_terrain().is_line_open(pos, goal):
+                target_pos = pos.normalize_distance(goal, move_distance / OG_METER, self._game.get_map_bounds())
+            else:
+                # around obstacles along the flow field shared with all characters of the same faction,
+                # or along one towards other if the shared field leads to a closer target
+                target_pos = self._game.get_path_flow_field(self, other).walk(
+                    pos, goal, move_distance / OG_METER, requested_distance, self._game.get_map_bounds())
+            self.move(target_pos, other, requested_distance)
 
     def get_ranged_weapon(self):
         try:
@@ -277,17 +343,14 @@ class Character(JsonSerializable, ApiParameter, ABC):
     def send_character_event(self, event, data=None):
         data = {} if data is None else data
         data["characterId"] = self._id
-        from gamecontroller import GameController
-        GameController.instance().send_game_event(event, data)
+        self._game.send_game_event(event, data)
 
     def __repr__(self):
         is_dead = ", dead" if self.is_dead() else ""
         return f"{type(self).__name__}(id={self._id}, name={self.get_name()}, hp={self._curr_life}/{self._max_life}{is_dead})"
 
     def get_stats(self):
-        weapon = self._active_weapon
-        return CharacterStats(self._curr_life, self._max_life, self._armor,
-                              weapon._dices, weapon._dice_type, weapon._additional)
+        return CharacterStats(self._curr_life, self._max_life, self._armor, *self._active_weapon.get_damage())
 
     def _apply_stats(self, stats):
         self._max_life = stats.max_hp
@@ -295,10 +358,10 @@ class Character(JsonSerializable, ApiParameter, ABC):
         self._armor = stats.armor
 
         affected_weapon = self._active_weapon if stats._affected_weapon is None else stats._affected_weapon
-        affected_weapon._dices = stats.dice
-        affected_weapon._dice_type = stats.damage
-        affected_weapon._additional = stats.modifier
+        affected_weapon.set_damage(stats.dice, stats.damage, stats.modifier)
+        self._on_changed()
 
+    @game_command
     def transform(self, stats):
         self._prev_stats = self.get_stats()
         self._prev_stats._affected_weapon = self._active_weapon
@@ -309,6 +372,7 @@ class Character(JsonSerializable, ApiParameter, ABC):
             "back": False
         })
 
+    @game_command
     def retransform(self):
         self._apply_stats(self._prev_stats)
         self._prev_stats = None
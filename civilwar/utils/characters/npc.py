@@ -1,25 +1,33 @@
+import logging
+
 from .character import Character
 from .player_character import PlayerCharacter
-from ..constants import MEELE_RANGE, OG_METER
+from ..constants import OG_METER, FACTION_ALLY, FACTION_ENEMY
+from ..structured_log import get_logger, log_event
+
+_log = get_logger("npc")
 
 
 class NPC(Character):
 
+    __slots__ = ["_name", "_is_ally"]
+
     def get_name(self):
         return self._name
 
-    def __init__(self, character_id, dictionary, name, pos, is_ally):
-        super().__init__(character_id, dictionary, pos)
+    def __init__(self, character_id, template, name, pos, is_ally):
+        super().__init__(character_id, template, pos)
         self._name = name
         self._is_ally = is_ally
-        self._multi_attack = dictionary.get("multiAttack", False)
 
     def is_ally(self):
         return self._is_ally
 
+    def get_faction(self):
+        return FACTION_ALLY if self._is_ally else FACTION_ENEMY
+
     def make_turn(self):
-        from gamecontroller import GameController
-        game_controller = GameController.instance()
+        game_controller = self._game
 
         if self.is_dead():
             return
@@ -31,32 +39,31 @@ class NPC(Character):
         target_enemy = None
         enemies = self.get_enemies_with_distance(distance=self.get_movement_left() / OG_METER)
         for enemy in enemies:
-            in_meele_range = list(enemy.get_enemies_with_distance(distance=MEELE_RANGE / OG_METER))
-            if len(in_meele_range) <= 2:
+            if game_controller.get_melee_crowding(enemy) <= 2:
                 target_enemy = enemy
                 break
 
         if target_enemy is not None:
             distance = self.distance(target_enemy)
             required_distance = self._active_weapon.get_max_range()
-            print("Distance ", distance)
-            print("Req. distance", required_distance)
+            log_event(_log, logging.DEBUG, "approach", character=self._id, target=target_enemy.get_id(),
+                      distance=distance, required_distance=required_distance)
             if distance > required_distance:
                 self.move_towards(target_enemy, required_distance)
             game_controller.attack(self, target_enemy)
-            if self._multi_attack:
+            if self._template.multi_attack:
                 self._action_points += 1
                 game_controller.attack(self, target_enemy)
         else:
 
             # current weapon is ranged
             if self._active_weapon.is_ranged():
-                if self.get_active_weapon()._usages <= 0:
+                if self.get_active_weapon().get_usages() <= 0:
                     try:
                         longsword = next(filter(lambda x: x.get_name() == "Longsword", self._weapons))
                         self.switch_weapon(longsword)
                     except Exception as e:
-                        print("No longsword")
+                        log_event(_log, logging.INFO, "no longsword", character=self._id)
 
                 # check if there is an enemy in range
                 else:
@@ -69,7 +76,7 @@ class NPC(Character):
 
                 # we have a ranged weapon, switch to it
                 ranged_weapon = self.get_ranged_weapon()
-                if ranged_weapon is not None and ranged_weapon._usages > 0:
+                if ranged_weapon is not None and ranged_weapon.get_usages() > 0:
                     self.switch_weapon(ranged_weapon)
                     return
 
@@ -1,22 +1,26 @@
 from flask_socketio import emit
 
 from .character import Character
-import random
+from ..command_queue import game_command
+from ..constants import FACTION_PLAYER
 
 
 class PlayerCharacter(Character):
 
-    def __init__(self, character_id, dictionary):
-        super().__init__(character_id, dictionary)
-        self._name = dictionary["name"]
-        self._initiative = dictionary.get("initiative", 0)
+    __slots__ = ["_client_sids"]
+
+    def __init__(self, character_id, template):
+        super().__init__(character_id, template)
         self._client_sids = set()
 
     def get_name(self):
-        return self._name
+        return self._template.name
+
+    def get_faction(self):
+        return FACTION_PLAYER
 
     def int_roll(self):
-        roll = random.randint(1, 20) + self._initiative
+        roll = self._game.get_dice().d(20) + self._template.initiative
         return roll
 
     def to_json(self):
@@ -29,12 +33,16 @@ class PlayerCharacter(Character):
         from .npc import NPC
         return isinstance(other, PlayerCharacter) or (isinstance(other, NPC) and other.is_ally())
 
+    @game_command
     def add_client_sid(self, client_sid):
         self._client_sids.add(client_sid)
+        self._on_changed()
 
+    @game_command
     def remove_client_sid(self, client_sid):
         if client_sid in self._client_sids:
             self._client_sids.remove(client_sid)
+            self._on_changed()
 
     def send_to(self, event, data):
         for client_sid in self._client_sids:
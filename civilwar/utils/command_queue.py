@@ -0,0 +1,150 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from functools import update_wrapper
+
+from utils.metrics import Series, get_metrics
+from utils.structured_log import get_logger, log_event
+
+_log = get_logger("commands")
+
+
+class CommandQueueStopped(RuntimeError):
+
+    """Raised for commands of a game that was closed, they are never executed."""
+
+
+class CommandQueue:
+
+    """Executes the commands of one game one after another on a single consumer thread.
+
+    Commands issued by the consumer thread itself (e.g. an attack during an NPC turn) run right away,
+    so commands can call each other without deadlocking.
+    """
+
+    def __init__(self, name=None):
+        self._name = name
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._stats = {}
+
+    def is_consumer(self):
+        return self._thread is not None and self._thread.ident == threading.get_ident()
+
+    def submit(self, name, fn, *args, **kwargs):
+        # queues fn(*args, **kwargs) and returns a future of its result, raises CommandQueueStopped after stop
+        self._start()
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                raise CommandQueueStopped(f"Command queue {self._name} is stopped, {name} was rejected")
+            self._queue.put((name, fn, args, kwargs, future, time.perf_counter()))
+        return future
+
+    def execute(self, name, fn, *args, **kwargs):
+        # runs fn(*args, **kwargs) on the consumer thread and waits for its result
+        if self.is_consumer():
+            # nested command, it does not wait in the queue
+            started, failed = time.perf_counter(), True
+            try:
+                result = fn(*args, **kwargs)
+                failed = _is_error(result)
+                return result
+            finally:
+                self._record(name, None, time.perf_counter() - started, failed)
+        return self.submit(name, fn, *args, **kwargs).result()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._consume, daemon=True,
+                                                    name=f"commands-{self._name}")
+                    self._thread.start()
+
+    def stop(self):
+        # the running command completes, queued ones fail and new ones are rejected with CommandQueueStopped
+        with self._lock:
+            self._stopped = True
+            if self._thread is not None:
+                self._queue.put(None)
+
+    def is_stopped(self):
+        return self._stopped
+
+    def _consume(self):
+        while True:
+            command = self._queue.get()
+            if command is None:
+                break
+
+            name, fn, args, kwargs, future, submitted = command
+            if self._stopped:
+                future.set_exception(CommandQueueStopped(f"Command queue {self._name} was stopped, "
+                                                         f"{name} was not executed"))
+                continue
+
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._record(name, started - submitted, time.perf_counter() - started, True)
+                # background commands have no caller waiting for their result, the log is the only trace
+                log_event(_log, logging.ERROR, "command failed", queue=self._name, command=name, error=repr(e),
+                          traceback=traceback.format_exc())
+                future.set_exception(e)
+            else:
+                self._record(name, started - submitted, time.perf_counter() - started, _is_error(result))
+                future.set_result(result)
+
+    def _record(self, name, wait, run, failed):
+        stats = self._stats.get(name, None)
+        if stats is None:
+            stats = self._stats[name] = Series()
+        stats.record(run, failed, wait)
+        get_metrics().record("game_command", name, run, failed, wait)
+
+    def get_stats(self):
+        return dict((name, stats.to_json()) for name, stats in list(self._stats.items()))
+
+
+def _is_error(result):
+    # commands report failures as error responses, see create_error
+    return isinstance(result, dict) and result.get("success", None) is False
+
+
+class InlineCommandQueue(CommandQueue):
+
+    """Runs every command right away on the calling thread, for headless games owned by one thread."""
+
+    def is_consumer(self):
+        return True
+
+    def execute(self, name, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def submit(self, name, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def stop(self):
+        pass
+
+
+def game_command(fn):
+    # executes the decorated method on the command queue of its game, see get_command_queue
+    name = fn.__qualname__
+
+    def wrapped_function(self, *args, **kwargs):
+        return self.get_command_queue().execute(name, fn, self, *args, **kwargs)
+
+    return update_wrapper(wrapped_function, fn)
@@ -1,2 +1,22 @@
 MEELE_RANGE = 15
+
+# radius of a character token on the map in pixels, overlapping tokens are resolved on moves
+TOKEN_RADIUS = 12
 OG_METER = 152.5 / 434
+
+# character factions
+FACTION_PLAYER = 0
+FACTION_ALLY = 1
+FACTION_ENEMY = 2
+
+# character status codes
+STATUS_ALIVE = 0
+STATUS_KO = 1
+STATUS_DEAD = 2
+
+# faction => factions its characters fight, see is_allied_to
+HOSTILE_FACTIONS = {
+    FACTION_PLAYER: (FACTION_ENEMY,),
+    FACTION_ALLY: (FACTION_ENEMY,),
+    FACTION_ENEMY: (FACTION_PLAYER, FACTION_ALLY),
+}
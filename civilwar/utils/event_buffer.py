@@ -0,0 +1,67 @@
+import time
+from threading import RLock
+from contextlib import contextmanager
+
+
+class EventBuffer:
+
+    """Collects game events and hands them to `send` as ordered, sequence-numbered batches.
+
+    Outside of a batch() block every event is sent immediately as a batch of one. While any thread is
+    inside a batch() block, events of all threads are buffered.
+    """
+
+    def __init__(self, send, max_batch_size=250, flush_interval=0.5):
+        self._send = send
+        self._max_batch_size = max_batch_size
+        self._flush_interval = flush_interval
+        self._events = []
+        self._sequence = 0
+        self._depth = 0
+        self._first_buffered = None
+        self._lock = RLock()
+
+    def get_sequence(self):
+        return self._sequence
+
+    def is_batching(self):
+        return self._depth > 0
+
+    def push(self, event):
+        with self._lock:
+            self._sequence += 1
+            event["seq"] = self._sequence
+            self._events.append(event)
+
+            if self._depth == 0 or len(self._events) >= self._max_batch_size:
+                self.flush()
+            elif self._first_buffered is None:
+                self._first_buffered = time.time()
+            elif time.time() - self._first_buffered >= self._flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._events:
+                events = self._events
+                self._events = []
+                self._first_buffered = None
+                self._send(events)
+
+    def begin_batch(self):
+        with self._lock:
+            self._depth += 1
+
+    def end_batch(self):
+        with self._lock:
+            self._depth -= 1
+            if self._depth == 0:
+                self.flush()
+
+    @contextmanager
+    def batch(self):
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.end_batch()
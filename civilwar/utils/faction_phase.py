@@ -0,0 +1,40 @@
+from utils.constants import MEELE_RANGE, OG_METER
+
+
+class FactionPhase:
+
+    """Melee crowding counts for one NPC faction phase, updated incrementally while the NPCs act."""
+
+    def __init__(self, game_controller, melee_range=MEELE_RANGE / OG_METER):
+        self._game_controller = game_controller
+        self._melee_range = melee_range
+
+        # character id => number of living enemies in melee range of that character
+        self._crowding = {}
+
+    def get_melee_crowding(self, character):
+        count = self._crowding.get(character.get_id(), None)
+        if count is None:
+            count = len(list(character.get_enemies_with_distance(distance=self._melee_range)))
+            self._crowding[character.get_id()] = count
+        return count
+
+    def invalidate(self):
+        self._crowding = {}
+
+    def _update_around(self, character, pos, delta):
+        # adjust the count of every cached character that has `character` as enemy within melee range of pos
+        for other in self._game_controller.get_characters_in_radius(pos, self._melee_range):
+            other_id = other.get_id()
+            if other_id in self._crowding and not other.is_allied_to(character):
+                self._crowding[other_id] += delta
+
+    def on_character_moved(self, character, old_pos):
+        if self._crowding:
+            self._update_around(character, old_pos, -1)
+            self._update_around(character, character.get_pos(), 1)
+
+    def on_character_died(self, character):
+        self._crowding.pop(character.get_id(), None)
+        if self._crowding:
+            self._update_around(character, character.get_pos(), -1)
@@ -0,0 +1,191 @@
+import math
+
+import numpy as np
+
+# (row, column) offsets of the 8 neighbour cells and the length of a step to them, in cells
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+STEPS = [1, 1, 1, 1, math.sqrt(2), math.sqrt(2), math.sqrt(2), math.sqrt(2)]
+
+# upper bound of cells walked in one move, far more than any movement budget covers
+MAX_WALK_STEPS = 256
+
+
+class FlowField:
+
+    """Cost of the cheapest path from every terrain cell to the nearest target cell.
+
+    One field is shared by all characters chasing the same factions: every cell knows its next
+    cell towards the targets, so following the field costs a lookup per cell instead of a search
+    per character. Updates are incremental: the cells whose path led to a removed target or over a
+    step that got more expensive (e.g. a new obstacle) are invalidated, then all cells are relaxed
+    starting from the costs that are still valid. Moving a target is removing and adding one.
+    """
+
+    def __init__(self, terrain):
+        self._terrain = terrain
+        self._terrain_version = None
+        self._edges = None
+        self._targets = frozenset()
+        self._dist = None
+        self._next = None
+        # full computations, incremental updates and cells invalidated by them so far
+        self._stats = {"recomputed": 0, "warmStarted": 0, "invalidated": 0}
+
+    def get_targets(self):
+        return self._targets
+
+    def get_distances(self):
+        return self._dist
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    def update(self, target_cells):
+        # target_cells: iterable of (row, column), returns False if the field was up to date
+        target_cells = frozenset(target_cells)
+        terrain_changed = self._terrain_version != self._terrain.get_version()
+        if not terrain_changed and target_cells == self._targets and self._dist is not None:
+            return False
+
+        costs = self._terrain.get_costs()
+        old_edges = self._edges
+        if terrain_changed:
+            self._edges = self._compute_edges(costs)
+            self._terrain_version = self._terrain.get_version()
+
+        if self._dist is None:
+            dist = np.full(costs.shape, np.inf)
+            self._stats["recomputed"] += 1
+        else:
+            # the costs of all cells whose path is still walkable are upper bounds, relaxing only lowers them
+            dist = self._dist.copy()
+            invalid = self._invalidated(target_cells, old_edges if terrain_changed else None)
+            dist[invalid] = np.inf
+            self._stats["warmStarted"] += 1
+            self._stats["invalidated"] += int(np.count_nonzero(invalid))
+        if target_cells:
+            rows, columns = zip(*target_cells)
+            dist[list(rows), list(columns)] = 0
+
+        self._targets = target_cells
+        self._dist = self._relax(dist)
+        self._next = self._compute_next()
+        return True
+
+    def _invalidated(self, target_cells, old_edges):
+        # mask of the cells whose path led to a removed target or takes a step that got more expensive
+        invalid = np.zeros(self._dist.shape, dtype=bool)
+        removed = self._targets - target_cells
+        if removed:
+            rows, columns = zip(*removed)
+            invalid[list(rows), list(columns)] = True
+        if old_edges is not None:
+            for direction, (old_edge, edge) in enumerate(zip(old_edges, self._edges)):
+                invalid |= (self._next == direction) & (edge > old_edge)
+        if not invalid.any():
+            return invalid
+
+        # every cell whose next cell is invalid is invalid as well, one sweep per step along the paths
+        rows, columns = np.indices(self._dist.shape)
+        offsets = np.array(DIRECTIONS + [(0, 0)])
+        next_rows = rows + offsets[self._next, 0]
+        next_columns = columns + offsets[self._next, 1]
+        while True:
+            grown = invalid | invalid[next_rows, next_columns]
+            if np.array_equal(grown, invalid):
+                return invalid
+            invalid = grown
+
+    @staticmethod
+    def _compute_edges(costs):
+        # cost of the step from every cell to its neighbour in each direction, inf if it is not allowed
+        rows, columns = costs.shape
+        padded = np.full((rows + 2, columns + 2), np.inf)
+        padded[1:-1, 1:-1] = costs
+
+        edges = []
+        for (dr, dc), step in zip(DIRECTIONS, STEPS):
+            neighbour = padded[1 + dr:rows + 1 + dr, 1 + dc:columns + 1 + dc]
+            edge = step * (costs + neighbour) / 2
+            if dr != 0 and dc != 0:
+                # no diagonal steps past the corner of an obstacle
+                corner = np.isinf(padded[1 + dr:rows + 1 + dr, 1:-1]) | np.isinf(padded[1:-1, 1 + dc:columns + 1 + dc])
+                edge[corner] = np.inf
+            edges.append(edge)
+        return edges
+
+    def _relax(self, dist):
+        # all cells are relaxed at once until no cost changes, one sweep per cell of the longest path
+        rows, columns = dist.shape
+        padded = np.full((rows + 2, columns + 2), np.inf)
+        candidate = np.empty_like(dist)
+        while True:
+            padded[1:-1, 1:-1] = dist
+            best = dist.copy()
+            for (dr, dc), edge in zip(DIRECTIONS, self._edges):
+                np.add(edge, padded[1 + dr:rows + 1 + dr, 1 + dc:columns + 1 + dc], out=candidate)
+                np.minimum(best, candidate, out=best)
+            if np.array_equal(best, dist):
+                return best
+            dist = best
+
+    def _compute_next(self):
+        # index into DIRECTIONS of the next cell towards the targets, -1 on target and unreachable cells
+        rows, columns = self._dist.shape
+        padded = np.full((rows + 2, columns + 2), np.inf)
+        padded[1:-1, 1:-1] = self._dist
+        candidates = np.stack([edge + padded[1 + dr:rows + 1 + dr, 1 + dc:columns + 1 + dc]
+                               for (dr, dc), edge in zip(DIRECTIONS, self._edges)])
+        next_direction = np.argmin(candidates, axis=0).astype(np.int8)
+        next_direction[(self._dist == 0) | np.isinf(self._dist)] = -1
+        return next_direction
+
+    def get_next_cell(self, row, column):
+        direction = self._next[row, column]
+        if direction < 0:
+            return None
+        dr, dc = DIRECTIONS[direction]
+        return row + dr, column + dc
+
+    def leads_to(self, pos, cell):
+        # true if following the field from pos ends in the target cell `cell`, not another target
+        row, column = self._terrain.cell_of(pos)
+        for _ in range(self._dist.size):
+            next_cell = self.get_next_cell(row, column)
+            if next_cell is None:
+                return (row, column) == cell
+            row, column = next_cell
+        return False
+
+    def is_reachable(self, row, column):
+        return not np.isinf(self._dist[row, column])
+
+    def walk(self, start, goal, budget, stop_distance, bounds):
+        """End position of a move of at most budget pixels from start along the field towards goal.
+
+        The field is followed cell by cell until the goal is in a straight line over open ground,
+        the rest of the way is walked directly and ends stop_distance before the goal.
+        """
+        terrain = self._terrain
+        pos = start
+        for _ in range(MAX_WALK_STEPS):
+            remaining = pos.distance(goal) - stop_distance
+            if budget <= 0 or remaining <= 0:
+                break
+            if terrain.is_line_open(pos, goal):
+                return pos.normalize_distance(goal, min(budget, remaining), bounds)
+
+            row, column = terrain.cell_of(pos)
+            next_cell = self.get_next_cell(row, column)
+            if next_cell is None:
+                if not self.is_reachable(row, column):
+                    break
+                # in the cell of a target, walk straight up to the first obstacle
+                end = pos.normalize_distance(goal, min(budget, remaining), bounds)
+                return pos.interpolate(end, terrain.clip_line(pos, end))
+
+            next_center = terrain.cell_center(*next_cell)
+            step = pos.distance(next_center)
+            pos = pos.normalize_distance(next_center, budget, bounds)
+            budget -= step
+        return pos
@@ -2,6 +2,13 @@ from abc import abstractmethod, ABC
 
 
 class JsonSerializable(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def to_json(self):
         pass
+
+    def serialize(self):
+        # fully serialized form (plain dicts/lists), subclasses may cache it. must not be modified by the caller
+        from utils.api import json_serialize
+        return json_serialize(self.to_json())
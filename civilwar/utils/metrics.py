@@ -0,0 +1,178 @@
+import bisect
+import threading
+
+# upper bounds of the histogram buckets, in seconds and bytes
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PAYLOAD_BUCKETS = (32, 128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+# kind of series => (label of its names, description)
+KINDS = {
+    "socket_event": ("event", "socket event handlers"),
+    "game_command": ("command", "game commands"),
+}
+
+PREFIX = "civilwar"
+
+
+class Histogram:
+
+    """Number of observed values per bucket, like a Prometheus histogram. Quantiles are interpolated."""
+
+    __slots__ = ["buckets", "counts", "count", "sum", "max"]
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+
+        rank, cumulative = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    return self.max
+                lower = 0.0 if index == 0 else self.buckets[index - 1]
+                upper = min(self.buckets[index], self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def get_cumulative_counts(self):
+        # (upper bound, number of values <= upper bound) of every bucket, the last one is +Inf
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            yield self.buckets[index] if index < len(self.buckets) else float("inf"), cumulative
+
+    def to_json(self, scale=1):
+        return {
+            "avg": scale * self.sum / self.count if self.count > 0 else 0.0,
+            "p50": scale * self.quantile(0.5),
+            "p95": scale * self.quantile(0.95),
+            "p99": scale * self.quantile(0.99),
+            "max": scale * self.max,
+        }
+
+
+class Series:
+
+    """Calls, errors, latencies and optionally queue waits and payload sizes of one event or command."""
+
+    __slots__ = ["count", "errors", "latency", "wait", "payload"]
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.wait = None
+        self.payload = None
+
+    def record(self, seconds, failed=False, wait=None, payload=None):
+        self.count += 1
+        self.errors += 1 if failed else 0
+        self.latency.observe(seconds)
+        if wait is not None:
+            if self.wait is None:
+                self.wait = Histogram(LATENCY_BUCKETS)
+            self.wait.observe(wait)
+        if payload is not None:
+            if self.payload is None:
+                self.payload = Histogram(PAYLOAD_BUCKETS)
+            self.payload.observe(payload)
+
+    def to_json(self):
+        data = {"count": self.count, "errors": self.errors, "latency_ms": self.latency.to_json(1000)}
+        if self.wait is not None:
+            data["wait_ms"] = self.wait.to_json(1000)
+        if self.payload is not None:
+            data["payload_bytes"] = self.payload.to_json()
+        return data
+
+
+class Metrics:
+
+    """The series of all instrumented socket events and game commands of this process, by kind and name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = dict((kind, {}) for kind in KINDS)
+
+    def record(self, kind, name, seconds, failed=False, wait=None, payload=None):
+        with self._lock:
+            series = self._series[kind].get(name, None)
+            if series is None:
+                series = self._series[kind][name] = Series()
+            series.record(seconds, failed, wait, payload)
+
+    def reset(self):
+        with self._lock:
+            self._series = dict((kind, {}) for kind in KINDS)
+
+    def to_json(self):
+        with self._lock:
+            return dict((kind, dict((name, series.to_json()) for name, series in sorted(series_by_name.items())))
+                        for kind, series_by_name in self._series.items())
+
+    def to_prometheus(self):
+        # text exposition format, see https://prometheus.io/docs/instrumenting/exposition_formats/
+        lines = []
+        with self._lock:
+            for kind, series_by_name in self._series.items():
+                label, description = KINDS[kind]
+                series_by_name = sorted(series_by_name.items())
+                metric = f"{PREFIX}_{kind}"
+                self._write_histograms(lines, f"{metric}_duration_seconds", f"Latency of the {description}.",
+                                       label, [(name, series.latency) for name, series in series_by_name])
+                self._write_histograms(lines, f"{metric}_wait_seconds", f"Queue wait of the {description}.",
+                                       label, [(name, series.wait) for name, series in series_by_name])
+                self._write_histograms(lines, f"{metric}_payload_bytes", f"Payload size of the {description}.",
+                                       label, [(name, series.payload) for name, series in series_by_name])
+                if series_by_name:
+                    lines.append(f"# HELP {metric}_errors_total Failed calls of the {description}.")
+                    lines.append(f"# TYPE {metric}_errors_total counter")
+                    for name, series in series_by_name:
+                        lines.append(f"{metric}_errors_total{{{label}=\"{_escape(name)}\"}} {series.errors}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_histograms(lines, metric, description, label, histograms):
+        histograms = [(name, histogram) for name, histogram in histograms if histogram is not None]
+        if not histograms:
+            return
+
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in histograms:
+            labels = f"{label}=\"{_escape(name)}\""
+            for upper, cumulative in histogram.get_cumulative_counts():
+                lines.append(f"{metric}_bucket{{{labels},le=\"{_format_bound(upper)}\"}} {cumulative}")
+            lines.append(f"{metric}_sum{{{labels}}} {histogram.sum!r}")
+            lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+
+def _escape(label_value):
+    return label_value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_bound(upper):
+    return "+Inf" if upper == float("inf") else repr(upper)
+
+
+metrics = Metrics()
+
+
+def get_metrics():
+    return metrics
@@ -0,0 +1,57 @@
+import itertools
+import threading
+
+from utils.json_serializable import JsonSerializable
+
+
+class NPCPhase(JsonSerializable):
+
+    """Handle of a running NPC faction phase: progress, cancellation and completion.
+
+    The phase is run by GameController._npc_phase_step, one NPC turn per command on the game's command
+    queue, so other commands are executed in between. Cancelling stops it before the next NPC takes its
+    turn, that NPC stays the active character.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, is_ally, total):
+        self._id = next(self._ids)
+        self._is_ally = is_ally
+        self._total = total
+        self._done = 0
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    def get_id(self):
+        return self._id
+
+    def get_progress(self):
+        return self._done, self._total
+
+    def step(self):
+        self._done += 1
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def finish(self):
+        self._finished.set()
+
+    def is_running(self):
+        return not self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def to_json(self):
+        return {
+            "id": self._id,
+            "is_ally": self._is_ally,
+            "done": self._done,
+            "total": self._total,
+            "cancelled": self.is_cancelled(),
+        }
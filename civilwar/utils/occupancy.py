@@ -0,0 +1,159 @@
+import math
+
+# edge length of an occupancy cell in pixels, about the diameter of a token
+DEFAULT_CELL_SIZE = 32
+
+# rings of candidate slots searched by find_slot, from the outermost one inwards
+MAX_SLOT_RINGS = 6
+
+
+class OccupancyGrid:
+
+    """Tokens of all living characters as circles (position + radius) bucketed in a uniform grid.
+
+    Tokens may pass each other during a move but must not overlap where a move ends, see resolve.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self._cell_size = cell_size
+        # cell => {character id: (x, y, radius)}
+        self._cells = {}
+        # character id => (cell, x, y, radius)
+        self._tokens = {}
+        # largest radius ever inserted, bounds the cells a query has to look at
+        self._max_radius = 0
+
+    def _cell_of(self, x, y):
+        return int(x // self._cell_size), int(y // self._cell_size)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, character):
+        return character.get_id() in self._tokens
+
+    def insert(self, character):
+        pos = character.get_pos()
+        x, y, radius = pos[0], pos[1], character.get_token_radius()
+        cell = self._cell_of(x, y)
+        self._cells.setdefault(cell, {})[character.get_id()] = (x, y, radius)
+        self._tokens[character.get_id()] = (cell, x, y, radius)
+        if radius > self._max_radius:
+            self._max_radius = radius
+
+    def insert_many(self, characters):
+        for character in characters:
+            self.insert(character)
+
+    def remove(self, character):
+        token = self._tokens.pop(character.get_id(), None)
+        if token is not None:
+            bucket = self._cells[token[0]]
+            del bucket[character.get_id()]
+            if not bucket:
+                del self._cells[token[0]]
+
+    def update(self, character):
+        token = self._tokens.get(character.get_id(), None)
+        if token is None:
+            # not placed (e.g. dead), nothing to update
+            return
+
+        pos = character.get_pos()
+        x, y, radius = pos[0], pos[1], token[3]
+        cell = self._cell_of(x, y)
+        if cell == token[0]:
+            self._cells[cell][character.get_id()] = (x, y, radius)
+            self._tokens[character.get_id()] = (cell, x, y, radius)
+        else:
+            self.remove(character)
+            self._cells.setdefault(cell, {})[character.get_id()] = (x, y, radius)
+            self._tokens[character.get_id()] = (cell, x, y, radius)
+
+    def clear(self):
+        self._cells = {}
+        self._tokens = {}
+        self._max_radius = 0
+
+    def _tokens_in(self, min_x, min_y, max_x, max_y, ignore_id):
+        # (x, y, radius) of all tokens in the cells overlapping the rectangle, except the one of ignore_id
+        min_cx, min_cy = self._cell_of(min_x, min_y)
+        max_cx, max_cy = self._cell_of(max_x, max_y)
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                bucket = self._cells.get((cx, cy), None)
+                if bucket:
+                    for character_id, token in bucket.items():
+                        if character_id != ignore_id:
+                            yield token
+
+    def is_free(self, pos, radius, ignore=None):
+        # true if a token of radius at pos would not overlap any other token, touching is allowed
+        x, y = pos[0], pos[1]
+        reach = radius + self._max_radius
+        ignore_id = None if ignore is None else ignore.get_id()
+        for other_x, other_y, other_radius in self._tokens_in(x - reach, y - reach, x + reach, y + reach, ignore_id):
+            if (other_x - x) ** 2 + (other_y - y) ** 2 < (radius + other_radius) ** 2:
+                return False
+        return True
+
+    def resolve(self, character, start, end):
+        """Fraction (0 - 1) of the way from start to end where the token of character should stop.
+
+        That is the free slot closest to end: 1 if end is free, otherwise the last point before the
+        tokens covering it. A token never moves back, if no point after start is free it stays at 0.
+        """
+        radius = character.get_token_radius()
+        if self.is_free(end, radius, character):
+            return 1.0
+
+        # the interval (t0, t1) of the path in which the token would overlap each nearby token
+        start_x, start_y = start[0], start[1]
+        dx, dy = end[0] - start_x, end[1] - start_y
+        a = dx ** 2 + dy ** 2
+        if a == 0:
+            return 0.0
+        reach = radius + self._max_radius
+        blocked = []
+        for other_x, other_y, other_radius in self._tokens_in(min(start_x, end[0]) - reach, min(start_y, end[1]) - reach,
+                                                              max(start_x, end[0]) + reach, max(start_y, end[1]) + reach,
+                                                              character.get_id()):
+            ox, oy = start_x - other_x, start_y - other_y
+            b = 2 * (ox * dx + oy * dy)
+            c = ox ** 2 + oy ** 2 - (radius + other_radius) ** 2
+            discriminant = b ** 2 - 4 * a * c
+            if discriminant > 0:
+                root = math.sqrt(discriminant)
+                blocked.append(((-b - root) / (2 * a), (-b + root) / (2 * a)))
+
+        # step back from the end over the intervals covering it, in descending order one pass is enough
+        fraction = 1.0
+        for t0, t1 in sorted(blocked, reverse=True):
+            if t0 < fraction < t1:
+                fraction = t0
+        return max(0.0, fraction)
+
+    def find_slot(self, character, center, min_distance, max_distance, prefer, accept=None):
+        """Free position (x, y) for the token of character at min_distance - max_distance from center.
+
+        Candidates lie on rings around center, about one token radius apart, the free one closest to
+        prefer is returned. accept(x, y) may reject candidates. None if no candidate is left.
+        """
+        radius = character.get_token_radius()
+        step = max(radius, 1)
+        candidates = []
+        distance = max_distance
+        for _ in range(MAX_SLOT_RINGS):
+            if distance < min_distance or distance <= 0:
+                break
+            count = max(8, math.ceil(2 * math.pi * distance / step))
+            for i in range(count):
+                angle = 2 * math.pi * i / count
+                candidates.append((center[0] + distance * math.cos(angle), center[1] + distance * math.sin(angle)))
+            distance -= step
+
+        candidates.sort(key=lambda p: (p[0] - prefer[0]) ** 2 + (p[1] - prefer[1]) ** 2)
+        for x, y in candidates:
+            if (accept is None or accept(x, y)) and self.is_free((x, y), radius, character):
+                return x, y
+        return None
@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+
+# characters per formation of the clustered placement and their spread (standard deviation, pixels)
+CLUSTER_SIZE = 8
+CLUSTER_SPREAD = 20
+
+
+def place_uniform(amount, min_bounds, max_bounds, dice):
+    # uniformly distributed integer coordinates, the same draws as amount calls of Position.random
+    sides = [max_bounds[0] - min_bounds[0] + 1, max_bounds[1] - min_bounds[1] + 1]
+    return dice.roll_many(1, sides, [min_bounds[0] - 1, min_bounds[1] - 1], repeat=amount).reshape(amount, 2)
+
+
+def place_clustered(amount, min_bounds, max_bounds, dice):
+    # formations of CLUSTER_SIZE characters scattered normally around uniformly placed centers
+    clusters = math.ceil(amount / CLUSTER_SIZE)
+    centers = place_uniform(clusters, min_bounds, max_bounds, dice)
+
+    # box-muller transform of uniform draws, 1 - u keeps the log finite
+    u = dice.uniform(2 * amount).reshape(2, amount)
+    radius = CLUSTER_SPREAD * np.sqrt(-2 * np.log(1 - u[0]))
+    offsets = np.stack([radius * np.cos(2 * np.pi * u[1]), radius * np.sin(2 * np.pi * u[1])], axis=1)
+
+    positions = centers[np.arange(amount) // CLUSTER_SIZE] + np.rint(offsets).astype(np.int64)
+    return np.clip(positions, min_bounds, max_bounds)
+
+
+def place_grid(amount, min_bounds, max_bounds, dice=None, front_first=True):
+    # evenly spaced lines filling the zone, the first line is at the front (lowest y if front_first)
+    width, height = max_bounds[0] - min_bounds[0] + 1, max_bounds[1] - min_bounds[1] + 1
+    columns = min(amount, max(1, math.ceil(math.sqrt(amount * width / height))))
+    rows = math.ceil(amount / columns)
+    spacing_x, spacing_y = width / columns, height / rows
+
+    index = np.arange(amount)
+    row, column = index // columns, index % columns
+    # center the last, partially filled line
+    row_length = np.where(row == rows - 1, amount - (rows - 1) * columns, columns)
+    x = min_bounds[0] + (column + (columns - row_length) / 2 + 0.5) * spacing_x
+    line = row if front_first else rows - 1 - row
+    y = min_bounds[1] + (line + 0.5) * spacing_y
+    positions = np.stack([np.floor(x), np.floor(y)], axis=1).astype(np.int64)
+    return np.clip(positions, min_bounds, max_bounds)
+
+
+PLACEMENTS = {
+    "uniform": place_uniform,
+    "clustered": place_clustered,
+    "grid": place_grid,
+}
+
+
+def place(placement, amount, min_bounds, max_bounds, dice, front_first=True):
+    """Positions (int array of shape (amount, 2)) of amount characters within the inclusive bounds."""
+    min_bounds = np.asarray([min_bounds[0], min_bounds[1]], dtype=np.int64)
+    max_bounds = np.asarray([max_bounds[0], max_bounds[1]], dtype=np.int64)
+    if placement == "grid":
+        return place_grid(amount, min_bounds, max_bounds, dice, front_first)
+    return PLACEMENTS[placement](amount, min_bounds, max_bounds, dice)
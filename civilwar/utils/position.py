@@ -1,3 +1,4 @@
+import math
 import random
 
 from utils.api import ApiParameter, create_error
@@ -7,6 +8,8 @@ from utils.vec2 import Vector2D
 
 class Position(Vector2D, ApiParameter):
 
+    __slots__ = ()
+
     def __init__(self, x, y):
         super(Position, self).__init__(x, y)
 
@@ -38,20 +41,38 @@ class Position(Vector2D, ApiParameter):
         return Position(value[0], value[1])
 
     @staticmethod
-    def random(min_bounds, max_bounds):
-        x = random.randint(min_bounds[0], max_bounds[0])
-        y = random.randint(min_bounds[1], max_bounds[1])
+    def random(min_bounds, max_bounds, dice=None):
+        # uniformly distributed integer coordinates within the (inclusive) bounds
+        if dice is None:
+            x = random.randint(min_bounds[0], max_bounds[0])
+            y = random.randint(min_bounds[1], max_bounds[1])
+        else:
+            x = min_bounds[0] - 1 + dice.d(max_bounds[0] - min_bounds[0] + 1)
+            y = min_bounds[1] - 1 + dice.d(max_bounds[1] - min_bounds[1] + 1)
         return Position(x, y)
 
     def distance(self, other_pos, factor=1.0):
-        return (other_pos - self).length() * factor
-
-    def normalize_distance(self, other_pos, max_distance, bounds: Vector2D):
-        dist_vector = (other_pos - self)
-        dir_vector = dist_vector.normalize()
-        dist = min(dist_vector.length(), max_distance)
-        destination = (self + (dir_vector * dist)).to_pos()
-        return destination.to_bounds(bounds)
+        # same arithmetic as (other_pos - self).length(), without the intermediate vector
+        dx = other_pos[0] - self._x
+        dy = other_pos[1] - self._y
+        return math.sqrt(dx ** 2 + dy ** 2) * factor
+
+    def normalize_distance(self, other_pos, max_distance, bounds):
+        # moves at most max_distance towards other_pos and clamps to bounds, only the result is allocated
+        dx = other_pos[0] - self._x
+        dy = other_pos[1] - self._y
+        length = math.sqrt(dx ** 2 + dy ** 2)
+        if length > 0:
+            dir_x, dir_y = dx / length, dy / length
+        else:
+            dir_x, dir_y = 0, 0
+        dist = min(length, max_distance)
+        return Position(clamp(self._x + dir_x * dist, bounds[0], bounds[2]),
+                        clamp(self._y + dir_y * dist, bounds[1], bounds[3]))
+
+    def interpolate(self, other_pos, fraction):
+        # the point at fraction (0 - 1) of the way to other_pos
+        return Position(self._x + (other_pos[0] - self._x) * fraction, self._y + (other_pos[1] - self._y) * fraction)
 
     def to_bounds(self, bounds):
         # bounds: [min_x, min_y, max_x, max_y]
@@ -0,0 +1,313 @@
+import functools
+import itertools
+import multiprocessing
+import threading
+import traceback
+import zlib
+
+from utils.api import json_serialize
+from utils.json_serializable import JsonSerializable
+from utils import wire_format
+
+# command target of registry operations (reset/remove a game), other targets are None (the game) or a character id
+REGISTRY = "registry"
+
+
+class LocalBroker:
+
+    """Message broker stand-in built on multiprocessing queues, no external service needed.
+
+    Every shard reads its commands from its own queue, all shards publish replies and game events
+    to one queue read by the frontend.
+    """
+
+    def __init__(self, shards, context=None):
+        context = multiprocessing.get_context() if context is None else context
+        self._commands = [context.Queue() for _ in range(shards)]
+        self._events = context.Queue()
+
+    def get_shard_count(self):
+        return len(self._commands)
+
+    def send_command(self, shard, message):
+        self._commands[shard].put(message)
+
+    def receive_command(self, shard):
+        return self._commands[shard].get()
+
+    def publish(self, message):
+        self._events.put(message)
+
+    def receive_event(self):
+        return self._events.get()
+
+
+class CharacterRef:
+
+    """Picklable reference to a character, characters never leave the shard of their game.
+
+    References in replies carry the serialized character, so reads like getAllies need one round trip.
+    """
+
+    __slots__ = ["character_id", "state"]
+
+    def __init__(self, character_id, state=None):
+        self.character_id = character_id
+        self.state = state
+
+    def __getstate__(self):
+        return self.character_id, self.state
+
+    def __setstate__(self, state):
+        self.character_id, self.state = state
+
+
+class ShardWorker:
+
+    """Hosts the games assigned to one shard and executes their commands one after another."""
+
+    def __init__(self, shard, broker):
+        from gamecontroller import GameRegistry
+        self._shard = shard
+        self._broker = broker
+        self._registry = GameRegistry(broadcast=self._publish_event)
+
+    def _publish_event(self, event, data, room):
+        self._broker.publish(("event", room, event, json_serialize(data)))
+
+    def run(self):
+        while True:
+            message = self._broker.receive_command(self._shard)
+            if message is None:
+                break
+
+            request_id, room, target, method, args, kwargs = message
+            try:
+                reply = (True, self._marshal(self._execute(room, target, method, args, kwargs)))
+            except Exception:
+                reply = (False, traceback.format_exc())
+            self._broker.publish(("reply", request_id) + reply)
+
+    def _execute(self, room, target, method, args, kwargs):
+        if method.startswith("_"):
+            raise AttributeError(f"Private method: {method}")
+
+        if target == REGISTRY:
+            getattr(self._registry, method)(room, *args, **kwargs)
+            return None
+
+        game = self._registry.get(room)
+        if target is None:
+            obj = game
+        else:
+            obj = game.get_character(target)
+            if obj is None:
+                raise KeyError(f"No such character id={target}")
+
+        args = [self._resolve(game, arg) for arg in args]
+        kwargs = dict((key, self._resolve(game, value)) for key, value in kwargs.items())
+        return getattr(obj, method)(*args, **kwargs)
+
+    def _resolve(self, game, value):
+        if isinstance(value, CharacterRef):
+            return game.get_character(value.character_id)
+        elif isinstance(value, dict):
+            return dict((key, self._resolve(game, v)) for key, v in value.items())
+        elif isinstance(value, list):
+            return [self._resolve(game, v) for v in value]
+        return value
+
+    def _marshal(self, value):
+        from utils.characters.character import Character
+        if isinstance(value, Character):
+            return CharacterRef(value.get_id(), value.serialize())
+        elif isinstance(value, JsonSerializable):
+            return value.serialize()
+        elif isinstance(value, dict):
+            return dict((key, self._marshal(v)) for key, v in value.items())
+        elif isinstance(value, (list, tuple, filter, map)):
+            return [self._marshal(v) for v in value]
+        return value
+
+
+def run_shard(shard, broker):
+    ShardWorker(shard, broker).run()
+
+
+class ShardRouter:
+
+    """Frontend side of the shards: forwards commands to the shard owning a game and fans out its events.
+
+    Games are pinned to a shard by a stable hash of their room, replies and events are read by one
+    background thread and handed to the waiting caller or broadcast to the room's clients.
+    """
+
+    def __init__(self, broker, emit_fn, timeout=30):
+        self._broker = broker
+        self._emit_fn = emit_fn
+        self._timeout = timeout
+        self._request_ids = itertools.count(1)
+        self._pending = {}
+        self._processes = []
+        self._thread = None
+
+    def start(self):
+        for shard in range(self._broker.get_shard_count()):
+            process = multiprocessing.Process(target=run_shard, args=(shard, self._broker), daemon=True,
+                                              name=f"shard-{shard}")
+            process.start()
+            self._processes.append(process)
+
+        self._thread = threading.Thread(target=self._receive_events, daemon=True, name="shard-events")
+        self._thread.start()
+
+    def stop(self):
+        for shard in range(len(self._processes)):
+            self._broker.send_command(shard, None)
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+        self._broker.publish(None)
+        self._thread.join()
+
+    def get_shard(self, room):
+        return zlib.crc32(room.encode("utf-8")) % self._broker.get_shard_count()
+
+    def call(self, room, target, method, *args, **kwargs):
+        request_id = next(self._request_ids)
+        waiter = [threading.Event(), None]
+        self._pending[request_id] = waiter
+
+        args = [self._marshal(arg) for arg in args]
+        kwargs = dict((key, self._marshal(value)) for key, value in kwargs.items())
+        self._broker.send_command(self.get_shard(room), (request_id, room, target, method, args, kwargs))
+
+        if not waiter[0].wait(self._timeout):
+            self._pending.pop(request_id, None)
+            raise TimeoutError(f"Shard {self.get_shard(room)} did not answer {method} within {self._timeout}s")
+
+        success, result = waiter[1]
+        if not success:
+            raise RuntimeError(f"Shard {self.get_shard(room)} failed to execute {method}:\n{result}")
+        return self._unmarshal(room, result)
+
+    def _receive_events(self):
+        while True:
+            message = self._broker.receive_event()
+            if message is None:
+                break
+
+            if message[0] == "reply":
+                waiter = self._pending.pop(message[1], None)
+                if waiter is not None:
+                    waiter[1] = message[2:]
+                    waiter[0].set()
+            else:
+                _, room, event, data = message
+                wire_format.broadcast(event, data, room, self._emit_fn)
+
+    def _marshal(self, value):
+        if isinstance(value, RemoteCharacter):
+            return CharacterRef(value.get_id())
+        elif isinstance(value, dict):
+            return dict((key, self._marshal(v)) for key, v in value.items())
+        elif isinstance(value, (list, tuple)):
+            return [self._marshal(v) for v in value]
+        return value
+
+    def _unmarshal(self, room, value):
+        if isinstance(value, CharacterRef):
+            return RemoteCharacter(self, room, value.character_id, value.state)
+        elif isinstance(value, dict):
+            return dict((key, self._unmarshal(room, v)) for key, v in value.items())
+        elif isinstance(value, list):
+            return [self._unmarshal(room, v) for v in value]
+        return value
+
+
+class RemoteGame:
+
+    """Stand-in for the GameController of a room hosted by a shard, method calls are forwarded to it."""
+
+    def __init__(self, router, room):
+        self._router = router
+        self._room = room
+
+    def get_room(self):
+        return self._room
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return functools.partial(self._router.call, self._room, None, name)
+
+
+class RemoteCharacter(JsonSerializable):
+
+    """Stand-in for a character of a game hosted by a shard, method calls are forwarded to it.
+
+    The serialized state of the reply it came with is served until a method is called through it.
+    """
+
+    def __init__(self, router, room, character_id, state=None):
+        self._router = router
+        self._room = room
+        self._id = character_id
+        self._state = state
+
+    def get_id(self):
+        return self._id
+
+    def to_json(self):
+        return self.serialize()
+
+    def serialize(self):
+        if self._state is None:
+            self._state = self._router.call(self._room, self._id, "serialize")
+        return self._state
+
+    def _call(self, name, *args, **kwargs):
+        # the call may change the character, its state is fetched again when needed
+        self._state = None
+        return self._router.call(self._room, self._id, name, *args, **kwargs)
+
+    def __eq__(self, other):
+        return isinstance(other, RemoteCharacter) and (self._room, self._id) == (other._room, other._id)
+
+    def __hash__(self):
+        return hash((self._room, self._id))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return functools.partial(self._call, name)
+
+    def __repr__(self):
+        return f"RemoteCharacter(room={self._room}, id={self._id})"
+
+
+class ShardedGameRegistry:
+
+    """GameRegistry of a frontend whose games are hosted by shard worker processes."""
+
+    DEFAULT_ROOM = "default"
+
+    def __init__(self, router):
+        self._router = router
+        self._rooms = set()
+
+    def get(self, room=DEFAULT_ROOM):
+        self._rooms.add(room)
+        return RemoteGame(self._router, room)
+
+    def reset(self, room=DEFAULT_ROOM):
+        self._router.call(room, REGISTRY, "reset")
+        return self.get(room)
+
+    def remove(self, room):
+        self._router.call(room, REGISTRY, "remove")
+        self._rooms.discard(room)
+
+    def get_rooms(self):
+        return list(self._rooms)
@@ -0,0 +1,256 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from utils.characters.player_character import PlayerCharacter
+from utils.json_serializable import JsonSerializable
+from utils.structured_log import get_logger, log_event
+
+_log = get_logger("simulation")
+
+# ongoing: max_rounds reached, stalemate: no hp or status changed for stalemate_rounds rounds
+OUTCOMES = ["won", "lost", "ongoing", "stalemate"]
+
+# battles per batch at most, progress is reported and cancellation checked once per batch
+MAX_BATCH_SIZE = 50
+
+# process pool shared by all simulations, started on first use
+_pool = None
+_pool_size = None
+
+
+def _player_turn(game, character):
+    # simulated players attack the closest enemy, approaching it first if it is out of range
+    if character.is_dead() or character.is_ko() or character.is_stunned():
+        return
+
+    enemy = character.get_closest_enemy()
+    if enemy is None:
+        return
+
+    max_range = character.get_active_weapon().get_max_range()
+    if character.distance(enemy) > max_range:
+        character.move_towards(enemy, max_range)
+    game.attack(character, enemy)
+
+
+def _combat_state(game):
+    table = game.get_character_table()
+    return table.hp.tobytes(), table.status.tobytes()
+
+
+def run_battle(game, max_rounds=100, auto_players=True, stalemate_rounds=10):
+    # plays the (headless) game until it is decided, stalls or max_rounds more rounds were played.
+    # returns (outcome, rounds played, ids of the characters that died per faction)
+    from gamecontroller import FACTION_NAMES
+    initially_dead = set(c.get_id() for c in game.get_all_characters().values() if c.is_dead())
+
+    turn_order = game.get_turn()
+    if turn_order.get_active() is None:
+        game.start()
+
+    start_round = turn_order.get_round()
+    last_round, last_state, last_change = start_round, _combat_state(game), start_round
+    outcome = None
+    while game.get_game_state() == "ongoing" and turn_order.get_round() - start_round < max_rounds:
+        active_char = turn_order.get_active()
+        if active_char is None:
+            break
+        if auto_players and isinstance(active_char, PlayerCharacter):
+            _player_turn(game, active_char)
+        game.next_turn(background=False)
+
+        if turn_order.get_round() != last_round:
+            last_round, state = turn_order.get_round(), _combat_state(game)
+            if state != last_state:
+                last_state, last_change = state, last_round
+            elif last_round - last_change >= stalemate_rounds:
+                outcome = "stalemate"
+                break
+
+    died = dict((faction, []) for faction in FACTION_NAMES)
+    for character in game.get_all_characters().values():
+        if character.is_dead() and character.get_id() not in initially_dead:
+            died[character.get_faction()].append(character.get_id())
+
+    outcome = game.get_game_state() if outcome is None else outcome
+    return outcome, turn_order.get_round() - start_round, died
+
+
+def run_batch(snapshot, seeds, max_rounds=100, auto_players=True, stalemate_rounds=10):
+    results = []
+    for seed in seeds:
+        game = pickle.loads(snapshot)
+        game.get_dice().seed(seed)
+        results.append(run_battle(game, max_rounds, auto_players, stalemate_rounds))
+    return results
+
+
+def _get_pool(processes):
+    global _pool, _pool_size
+    if _pool is None or _pool_size != processes:
+        if _pool is not None:
+            _pool.shutdown()
+        # spawn, forking a server process with running threads is not safe
+        _pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        _pool_size = processes
+    return _pool
+
+
+def simulate(game, runs=1000, max_rounds=100, auto_players=True, processes=None, seed=None, stalemate_rounds=10,
+             job=None):
+    """Plays the rest of the battle of game `runs` times on headless copies and summarizes the outcomes.
+
+    Works with any game offering snapshot(), e.g. a GameController or a RemoteGame of a shard.
+    Batches run in a process pool of `processes` workers (default: number of CPUs), or in this
+    process if processes is 1. The same seed gives the same estimate.
+
+    A 41-character battle takes about 0.1s of one core, so 10000 runs take minutes rather than
+    seconds: run large simulations as a SimulationJob. Its progress is updated after every batch,
+    once it is cancelled only the battles played so far are summarized (None if there are none).
+    """
+    snapshot = game.snapshot()
+    seeds = np.random.SeedSequence(seed).generate_state(runs).tolist()
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    batch_size = min(MAX_BATCH_SIZE, max(1, -(-runs // (processes * 4))))
+    batches = [seeds[i:i + batch_size] for i in range(0, runs, batch_size)]
+    results = []
+    if processes <= 1:
+        for batch in batches:
+            if job is not None and job.is_cancelled():
+                break
+            results.extend(run_batch(snapshot, batch, max_rounds, auto_players, stalemate_rounds))
+            if job is not None:
+                job.step(len(batch))
+    else:
+        pool = _get_pool(processes)
+        futures = [pool.submit(run_batch, snapshot, batch, max_rounds, auto_players, stalemate_rounds)
+                   for batch in batches]
+        try:
+            for future in as_completed(futures):
+                batch_results = future.result()
+                results.extend(batch_results)
+                if job is not None:
+                    job.step(len(batch_results))
+                    if job.is_cancelled():
+                        break
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return summarize(results) if results else None
+
+
+class SimulationJob(JsonSerializable):
+
+    """Handle of a simulation running in the background: progress, cancellation and its result.
+
+    on_progress(job) is called from the simulating thread after every batch and once it is finished.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, runs, on_progress=None):
+        self._id = next(self._ids)
+        self._runs = runs
+        self._done = 0
+        self._on_progress = on_progress
+        self._result = None
+        self._error = None
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    def get_id(self):
+        return self._id
+
+    def get_progress(self):
+        return self._done, self._runs
+
+    def step(self, amount):
+        self._done += amount
+        if self._on_progress is not None:
+            self._on_progress(self)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self, game, **kwargs):
+        # simulates on the calling thread, see simulate for the arguments
+        try:
+            self._result = simulate(game, self._runs, job=self, **kwargs)
+        except Exception as e:
+            self._error = repr(e)
+            log_event(_log, logging.ERROR, "simulation failed", job=self._id, error=self._error,
+                      traceback=traceback.format_exc())
+        finally:
+            self._finished.set()
+            if self._on_progress is not None:
+                self._on_progress(self)
+
+    def is_running(self):
+        return not self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def get_result(self):
+        return self._result
+
+    def get_error(self):
+        return self._error
+
+    def to_json(self):
+        return {
+            "id": self._id,
+            "done": self._done,
+            "total": self._runs,
+            "cancelled": self.is_cancelled(),
+            "running": self.is_running(),
+            "error": self._error,
+            "result": self._result,
+        }
+
+
+def summarize(results):
+    from gamecontroller import FACTION_NAMES
+    runs = len(results)
+    outcomes = Counter(outcome for outcome, _, _ in results)
+    rounds = np.array([rounds for _, rounds, _ in results], dtype=float)
+
+    casualties = {}
+    for faction, name in FACTION_NAMES.items():
+        counts = Counter(len(died[faction]) for _, _, died in results)
+        casualties[name] = {
+            "mean": sum(amount * count for amount, count in counts.items()) / runs,
+            "distribution": dict((amount, counts[amount] / runs) for amount in sorted(counts)),
+        }
+
+    deaths = Counter(character_id for _, _, died in results for ids in died.values() for character_id in ids)
+
+    return {
+        "runs": runs,
+        "win_probability": outcomes["won"] / runs,
+        "outcomes": dict((outcome, outcomes[outcome] / runs) for outcome in OUTCOMES),
+        "expected_rounds": float(rounds.mean()),
+        "rounds": {
+            "min": int(rounds.min()),
+            "p50": float(np.percentile(rounds, 50)),
+            "p90": float(np.percentile(rounds, 90)),
+            "max": int(rounds.max()),
+        },
+        "casualties": casualties,
+        "death_probability": dict((character_id, deaths[character_id] / runs) for character_id in sorted(deaths)),
+    }
@@ -0,0 +1,146 @@
+DEFAULT_CELL_SIZE = 48
+
+
+class SpatialIndex:
+
+    """Uniform grid bucketing characters by their map position (in pixels)."""
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self._cell_size = cell_size
+        self._cells = {}
+        self._char_cells = {}
+
+        # bounding box of all cells ever occupied, used to stop the nearest-search
+        self._min_cell = None
+        self._max_cell = None
+
+    def _cell_of(self, x, y):
+        return int(x // self._cell_size), int(y // self._cell_size)
+
+    def __len__(self):
+        return len(self._char_cells)
+
+    def __contains__(self, character):
+        return character.get_id() in self._char_cells
+
+    def insert(self, character):
+        pos = character.get_pos()
+        cell = self._cell_of(pos[0], pos[1])
+        self._cells.setdefault(cell, {})[character.get_id()] = character
+        self._char_cells[character.get_id()] = cell
+
+        if self._min_cell is None:
+            self._min_cell = cell
+            self._max_cell = cell
+        else:
+            self._min_cell = (min(self._min_cell[0], cell[0]), min(self._min_cell[1], cell[1]))
+            self._max_cell = (max(self._max_cell[0], cell[0]), max(self._max_cell[1], cell[1]))
+
+    def insert_many(self, characters):
+        cells = []
+        for character in characters:
+            pos = character.get_pos()
+            cell = self._cell_of(pos[0], pos[1])
+            self._cells.setdefault(cell, {})[character.get_id()] = character
+            self._char_cells[character.get_id()] = cell
+            cells.append(cell)
+
+        if cells:
+            if self._min_cell is not None:
+                cells.extend([self._min_cell, self._max_cell])
+            self._min_cell = (min(cell[0] for cell in cells), min(cell[1] for cell in cells))
+            self._max_cell = (max(cell[0] for cell in cells), max(cell[1] for cell in cells))
+
+    def remove(self, character):
+        cell = self._char_cells.pop(character.get_id(), None)
+        if cell is not None:
+            bucket = self._cells[cell]
+            del bucket[character.get_id()]
+            if not bucket:
+                del self._cells[cell]
+
+    def update(self, character):
+        old_cell = self._char_cells.get(character.get_id(), None)
+        if old_cell is None:
+            # not indexed (e.g. dead), nothing to update
+            return
+
+        pos = character.get_pos()
+        if self._cell_of(pos[0], pos[1]) != old_cell:
+            self.remove(character)
+            self.insert(character)
+
+    def clear(self):
+        self._cells = {}
+        self._char_cells = {}
+        self._min_cell = None
+        self._max_cell = None
+
+    def query_radius(self, pos, radius):
+        # returns all characters within radius, ordered by id (= roster order of the game controller)
+        if radius < 0 or not self._cells:
+            return []
+
+        min_cx, min_cy = self._cell_of(pos[0] - radius, pos[1] - radius)
+        max_cx, max_cy = self._cell_of(pos[0] + radius, pos[1] + radius)
+        min_cx, min_cy = max(min_cx, self._min_cell[0]), max(min_cy, self._min_cell[1])
+        max_cx, max_cy = min(max_cx, self._max_cell[0]), min(max_cy, self._max_cell[1])
+
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self._cells):
+            buckets = (bucket for (cx, cy), bucket in self._cells.items()
+                       if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy)
+        else:
+            buckets = (self._cells.get((cx, cy), None)
+                       for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1))
+
+        result = []
+        for bucket in buckets:
+            if bucket:
+                for character in bucket.values():
+                    if pos.distance(character.get_pos()) <= radius:
+                        result.append(character)
+
+        result.sort(key=lambda c: c.get_id())
+        return result
+
+    def nearest(self, pos, predicate=None):
+        # closest character matching predicate, ties are broken by the lower id
+        if not self._cells:
+            return None
+
+        center_x, center_y = self._cell_of(pos[0], pos[1])
+        max_ring = max(abs(center_x - self._min_cell[0]), abs(center_x - self._max_cell[0]),
+                       abs(center_y - self._min_cell[1]), abs(center_y - self._max_cell[1]))
+
+        closest, closest_dist = None, None
+        for ring in range(max_ring + 1):
+            for cell in self._ring_cells(center_x, center_y, ring):
+                bucket = self._cells.get(cell, None)
+                if not bucket:
+                    continue
+                for character in bucket.values():
+                    if predicate is not None and not predicate(character):
+                        continue
+                    dist = pos.distance(character.get_pos())
+                    if closest is None or dist < closest_dist or \
+                            (dist == closest_dist and character.get_id() < closest.get_id()):
+                        closest, closest_dist = character, dist
+
+            # every character outside the scanned rings is at least ring * cell_size away
+            if closest is not None and closest_dist < ring * self._cell_size:
+                break
+
+        return closest
+
+    @staticmethod
+    def _ring_cells(center_x, center_y, ring):
+        if ring == 0:
+            yield center_x, center_y
+            return
+
+        for cx in range(center_x - ring, center_x + ring + 1):
+            yield cx, center_y - ring
+            yield cx, center_y + ring
+        for cy in range(center_y - ring + 1, center_y + ring):
+            yield center_x - ring, cy
+            yield center_x + ring, cy
@@ -0,0 +1,105 @@
+from collections import deque
+
+from utils.api import json_serialize
+
+
+class StateLog:
+
+    """Versions the serialized character state of a game with a global sequence number.
+
+    Characters are only marked dirty on mutation; they are serialized and diffed field by field
+    the next time changes are requested.
+    """
+
+    def __init__(self, max_history=10000):
+        self._sequence = 0
+        self._max_history = max_history
+
+        # (seq, character id) of every committed change, in sequence order
+        self._history = deque()
+        self._truncated_at = 0
+
+        self._snapshots = {}
+        self._field_seqs = {}
+        self._dirty = {}
+
+    def get_sequence(self):
+        return self._sequence
+
+    def _next_sequence(self):
+        self._sequence += 1
+        return self._sequence
+
+    def _append_history(self, seq, character_id):
+        self._history.append((seq, character_id))
+        while len(self._history) > self._max_history:
+            self._truncated_at = self._history.popleft()[0]
+
+    def mark_changed(self, character):
+        self._dirty[character.get_id()] = (self._next_sequence(), character)
+
+    def mark_changed_many(self, characters):
+        # one sequence number for all of them, e.g. for a bulk spawn
+        seq = self._next_sequence()
+        for character in characters:
+            self._dirty[character.get_id()] = (seq, character)
+
+    def mark_removed(self, character_id):
+        # committed like any other change, the history has to stay in sequence order
+        self._dirty[character_id] = (self._next_sequence(), None)
+
+    def commit(self):
+        # serializes all dirty characters, returns the sequence number the committed state belongs to
+        self._commit()
+        return self._sequence
+
+    def _commit(self):
+        for character_id, (seq, character) in sorted(self._dirty.items(), key=lambda item: item[1][0]):
+            if character is None:
+                self._snapshots.pop(character_id, None)
+                self._field_seqs.pop(character_id, None)
+                self._append_history(seq, character_id)
+                continue
+
+            state = json_serialize(character)
+            old_state = self._snapshots.get(character_id, {})
+            field_seqs = self._field_seqs.setdefault(character_id, {})
+            changed = False
+            for key, value in state.items():
+                if key not in old_state or old_state[key] != value:
+                    field_seqs[key] = seq
+                    changed = True
+
+            if changed:
+                self._snapshots[character_id] = state
+                self._append_history(seq, character_id)
+
+        self._dirty = {}
+
+    def get_snapshot(self):
+        self._commit()
+        return {"seq": self._sequence, "full": True, "characters": dict(self._snapshots), "removed": []}
+
+    def get_changes_since(self, since):
+        # returns None if the history does not reach back to since, a full snapshot is needed then
+        self._commit()
+        if since < self._truncated_at or since > self._sequence:
+            return None
+
+        changed_ids = set()
+        for seq, character_id in reversed(self._history):
+            if seq <= since:
+                break
+            changed_ids.add(character_id)
+
+        characters, removed = {}, []
+        for character_id in sorted(changed_ids):
+            state = self._snapshots.get(character_id, None)
+            if state is None:
+                removed.append(character_id)
+            else:
+                fields = dict((key, state[key]) for key, seq in self._field_seqs[character_id].items() if seq > since)
+                fields["id"] = character_id
+                characters[character_id] = fields
+
+        return {"seq": self._sequence, "full": False, "characters": characters, "removed": removed}
@@ -0,0 +1,184 @@
+import atexit
+import datetime
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+from utils.json_serializable import JsonSerializable
+
+ROOT_LOGGER = "civilwar"
+
+# subsystem => level, overridable with LOG_LEVELS="move=DEBUG,npc=WARNING"
+DEFAULT_LEVELS = {
+    "app": logging.INFO,
+    "commands": logging.INFO,
+    "config": logging.INFO,
+    "game": logging.INFO,
+    "events": logging.DEBUG,
+    "move": logging.DEBUG,
+    "npc": logging.INFO,
+    "simulation": logging.INFO,
+}
+
+# subsystem => only every n-th record is written, overridable with LOG_SAMPLING="move=100"
+DEFAULT_SAMPLING = {
+    "move": 10,
+}
+
+LOG_FILE = "civilwar.jsonl"
+
+# listener of the running logging pipeline and the arguments it was set up with, see setup_logging
+_listener = None
+_config = None
+
+
+def get_logger(subsystem):
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+
+def log_event(logger, level, msg, **fields):
+    # fields are serialized by the writer thread, pass values that do not change afterwards
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, extra={"fields": fields})
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    """One JSON object per record: time, level, logger, msg and the fields given to log_event."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None:
+            entry["sample_rate"] = sample_rate
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry["fields"] = fields
+        return json.dumps(entry, default=_json_default)
+
+
+def _json_default(value):
+    if isinstance(value, JsonSerializable):
+        return value.to_json()
+    return str(value)
+
+
+class SamplingFilter(logging.Filter):
+
+    """Lets only every n-th record of a logger pass, for high-frequency events like moves."""
+
+    def __init__(self, sampling):
+        super().__init__()
+        # logger name => n
+        self._sampling = sampling
+        # records are filtered on the logging threads, next() of an itertools.count is atomic, a += on a dict is not
+        self._counters = dict((name, itertools.count()) for name in sampling)
+
+    def filter(self, record):
+        every = self._sampling.get(record.name, 1)
+        if every <= 1:
+            return True
+
+        count = next(self._counters[record.name])
+        if count % every != 0:
+            return False
+        record.sample_rate = every
+        return True
+
+
+def _parse_overrides(value, parse, invalid):
+    # "a=1,b=2" => {"a": parse("1"), "b": parse("2")}, entries parse rejects with None are added to invalid
+    overrides = {}
+    for entry in (value or "").split(","):
+        if "=" in entry:
+            subsystem, setting = entry.split("=", 1)
+            parsed = parse(setting.strip())
+            if parsed is None:
+                invalid.append(entry.strip())
+            else:
+                overrides[subsystem.strip()] = parsed
+    return overrides
+
+
+def _parse_level(name):
+    # getLevelName returns the string "Level X" for unknown names
+    level = logging.getLevelName(name.upper())
+    return level if isinstance(level, int) else None
+
+
+def _parse_sampling(every):
+    return int(every) if every.isdigit() and int(every) > 0 else None
+
+
+def setup_logging(log_dir="logs", levels=None, sampling=None):
+    """Writes the records of all civilwar loggers as JSON lines to log_dir, from a background thread.
+
+    Callers only put records into a queue, formatting and file I/O happen on the listener thread.
+    Queued records are written at exit or by stop_logging.
+    """
+    global _listener, _config
+    stop_logging()
+    _config = (log_dir, levels, sampling)
+    levels = dict(DEFAULT_LEVELS, **(levels or {}))
+    invalid_levels, invalid_sampling = [], []
+    levels.update(_parse_overrides(os.getenv("LOG_LEVELS"), _parse_level, invalid_levels))
+    sampling = dict(DEFAULT_SAMPLING, **(sampling or {}))
+    sampling.update(_parse_overrides(os.getenv("LOG_SAMPLING"), _parse_sampling, invalid_sampling))
+
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    file_handler = logging.handlers.RotatingFileHandler(os.path.join(log_dir, LOG_FILE), maxBytes=64 * 1024 * 1024,
+                                                        backupCount=5, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(dict((f"{ROOT_LOGGER}.{subsystem}", every)
+                                                for subsystem, every in sampling.items())))
+
+    root_logger = logging.getLogger(ROOT_LOGGER)
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(logging.INFO)
+    root_logger.propagate = False
+    for subsystem, level in levels.items():
+        get_logger(subsystem).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _listener.start()
+
+    # unknown settings keep the default, a typo in the environment should not stop the server
+    config_logger = get_logger("config")
+    if invalid_levels:
+        log_event(config_logger, logging.WARNING, "ignoring invalid LOG_LEVELS entries", entries=invalid_levels)
+    if invalid_sampling:
+        log_event(config_logger, logging.WARNING, "ignoring invalid LOG_SAMPLING entries", entries=invalid_sampling)
+    return _listener
+
+
+@atexit.register
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _restart_after_fork():
+    # the listener thread does not survive a fork, e.g. into uwsgi workers, the child needs its own
+    if _listener is not None:
+        setup_logging(*_config)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
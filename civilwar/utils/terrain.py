@@ -0,0 +1,139 @@
+import math
+
+import numpy as np
+
+# edge length of a terrain cell in pixels
+TERRAIN_CELL_SIZE = 16
+
+# movement cost of open ground, obstacles have an infinite cost
+OPEN_COST = 1.0
+OBSTACLE_COST = math.inf
+
+
+class TerrainGrid:
+
+    """Movement cost of every cell of the map, a coarse grid over the pixel coordinates.
+
+    Open ground costs 1, rough terrain more and obstacles are impassable (inf). The version
+    is increased on every change, so derived data like flow fields knows when to recompute.
+    """
+
+    def __init__(self, map_size, cell_size=TERRAIN_CELL_SIZE):
+        self._cell_size = cell_size
+        self._shape = (math.ceil(map_size[1] / cell_size), math.ceil(map_size[0] / cell_size))
+        self._cost = np.full(self._shape, OPEN_COST, dtype=np.float64)
+        self._version = 0
+        # true while every cell is open ground, movement can then go in straight lines
+        self._is_open = True
+
+    def get_version(self):
+        return self._version
+
+    def get_cell_size(self):
+        return self._cell_size
+
+    def get_shape(self):
+        # (rows, columns)
+        return self._shape
+
+    def get_costs(self):
+        # read-only view, indexed [row, column]
+        view = self._cost.view()
+        view.flags.writeable = False
+        return view
+
+    def is_open(self):
+        return self._is_open
+
+    def cell_of(self, pos):
+        # (row, column) of the cell containing pos, positions outside the map map to the border cells
+        column = min(max(int(pos[0] // self._cell_size), 0), self._shape[1] - 1)
+        row = min(max(int(pos[1] // self._cell_size), 0), self._shape[0] - 1)
+        return row, column
+
+    def cells_of(self, positions):
+        # vectorized cell_of, positions is an array of shape (n, 2)
+        cells = np.floor_divide(np.asarray(positions, dtype=np.float64), self._cell_size).astype(np.int64)
+        rows = np.clip(cells[:, 1], 0, self._shape[0] - 1)
+        columns = np.clip(cells[:, 0], 0, self._shape[1] - 1)
+        return rows, columns
+
+    def cell_center(self, row, column):
+        return (column + 0.5) * self._cell_size, (row + 0.5) * self._cell_size
+
+    def get_cost(self, pos):
+        return float(self._cost[self.cell_of(pos)])
+
+    def is_blocked(self, pos):
+        return self._cost[self.cell_of(pos)] == OBSTACLE_COST
+
+    def set_cost(self, min_pos, max_pos, cost):
+        # sets the cost of all cells overlapping the (inclusive) pixel rectangle, returns the amount of cells
+        if not cost >= OPEN_COST:
+            raise ValueError(f"Invalid terrain cost: {cost}, it has to be at least {OPEN_COST}")
+        min_row, min_column = self.cell_of((min(min_pos[0], max_pos[0]), min(min_pos[1], max_pos[1])))
+        max_row, max_column = self.cell_of((max(min_pos[0], max_pos[0]), max(min_pos[1], max_pos[1])))
+        self._cost[min_row:max_row + 1, min_column:max_column + 1] = cost
+        self._on_changed()
+        return (max_row - min_row + 1) * (max_column - min_column + 1)
+
+    def set_obstacle(self, min_pos, max_pos):
+        return self.set_cost(min_pos, max_pos, OBSTACLE_COST)
+
+    def clear(self):
+        self._cost.fill(OPEN_COST)
+        self._on_changed()
+
+    def _on_changed(self):
+        self._version += 1
+        self._is_open = bool(np.all(self._cost == OPEN_COST))
+
+    def _cells_along(self, start, end):
+        # (rows, columns) of the cells touched by the segment start-end, sampled every quarter cell
+        length = math.sqrt((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2)
+        steps = max(1, math.ceil(4 * length / self._cell_size))
+        t = np.linspace(0, 1, steps + 1)
+        points = np.stack([start[0] + t * (end[0] - start[0]), start[1] + t * (end[1] - start[1])], axis=1)
+        return self.cells_of(points)
+
+    def is_line_open(self, start, end):
+        # true if the segment crosses open ground only, a straight move is then the shortest path
+        if self._is_open:
+            return True
+        rows, columns = self._cells_along(start, end)
+        return bool(np.all(self._cost[rows, columns] == OPEN_COST))
+
+    def clip_line(self, start, end):
+        # fraction (0 - 1) of the segment start-end that can be walked before the first obstacle
+        if self._is_open:
+            return 1.0
+        rows, columns = self._cells_along(start, end)
+        blocked = np.flatnonzero(self._cost[rows, columns] == OBSTACLE_COST)
+        if len(blocked) == 0:
+            return 1.0
+        # the last sample before the obstacle, a quarter cell of precision is enough for movement
+        return max(0, blocked[0] - 1) / (len(rows) - 1)
+
+    def nearest_open(self, pos):
+        # center of the nearest passable cell, pos itself if it is not blocked
+        if not self.is_blocked(pos):
+            return pos
+        rows, columns = np.nonzero(self._cost != OBSTACLE_COST)
+        if len(rows) == 0:
+            return pos
+        centers_x, centers_y = (columns + 0.5) * self._cell_size, (rows + 0.5) * self._cell_size
+        nearest = int(np.argmin((centers_x - pos[0]) ** 2 + (centers_y - pos[1]) ** 2))
+        return centers_x[nearest], centers_y[nearest]
+
+    def to_json(self):
+        # only the cells that are not open ground: [row, column, cost], obstacles have the cost None
+        rows, columns = np.nonzero(self._cost != OPEN_COST)
+        cells = [[row, column, None if cost == OBSTACLE_COST else cost]
+                 for row, column, cost in zip(rows.tolist(), columns.tolist(), self._cost[rows, columns].tolist())]
+        return {
+            "cellSize": self._cell_size,
+            "rows": self._shape[0],
+            "columns": self._shape[1],
+            "version": self._version,
+            "cells": cells,
+        }
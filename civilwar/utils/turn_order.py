@@ -1,37 +1,129 @@
 from utils.characters.character import Character
 
 
+class _TurnNode:
+
+    __slots__ = ["character", "prev", "next", "first_round", "removed"]
+
+    def __init__(self, character, first_round):
+        self.character = character
+        self.prev = None
+        self.next = None
+        self.first_round = first_round
+        self.removed = False
+
+
 class GameTurnOrder:
 
+    """Turn order as a doubly-linked ring with an id => nodes index.
+
+    The node of the active character stays linked as a tombstone when it is removed, so the round
+    continues behind it. Characters added during a round take part from the next round on,
+    characters inserted after the active one take part in the current round.
+    """
+
     def __init__(self):
-        self._original_queue = []
-        self._round_queue = []
-        self._active_char = None
-        self._round = 0
+        self.reset()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, character):
+        return character.get_id() in self._nodes
+
+    def __getstate__(self):
+        # the ring as a flat list, pickling the linked nodes would recurse once per node
+        nodes, cursor_index = [], None
+        node = self._head.next
+        while node is not self._head:
+            if node is self._cursor:
+                cursor_index = len(nodes)
+            if not node.removed or node is self._cursor:
+                nodes.append((node.character, node.first_round, node.removed))
+            node = node.next
+        return {"nodes": nodes, "cursor": cursor_index, "active": self._active_char, "round": self._round}
+
+    def __setstate__(self, state):
+        self.reset()
+        for index, (character, first_round, removed) in enumerate(state["nodes"]):
+            node = _TurnNode(character, first_round)
+            self._link_after(self._head.prev, node)
+            if index == state["cursor"]:
+                self._cursor = node
+            if removed:
+                character_nodes = self._nodes[character.get_id()]
+                character_nodes.remove(node)
+                if not character_nodes:
+                    del self._nodes[character.get_id()]
+                self._unlink(node)
+        self._active_char = state["active"]
+        self._round = state["round"]
+
+    def _link_after(self, prev_node, node):
+        node.prev = prev_node
+        node.next = prev_node.next
+        prev_node.next.prev = node
+        prev_node.next = node
+        self._nodes.setdefault(node.character.get_id(), []).append(node)
+        self._size += 1
+
+    def _unlink(self, node):
+        node.removed = True
+        self._size -= 1
+        if node is not self._cursor:
+            node.prev.next = node.next
+            node.next.prev = node.prev
 
     def add(self, character: Character):
-        self._original_queue.append(character)
+        # takes part from the next round on
+        self._link_after(self._head.prev, _TurnNode(character, self._round + 1))
 
     def add_all(self, characters: [Character]):
-        self._original_queue.extend(characters)
+        for character in characters:
+            self.add(character)
+
+    def insert_after_active(self, character: Character):
+        # takes part in the current round, right after the active character
+        self._link_after(self._cursor, _TurnNode(character, self._round))
 
     def reset(self):
-        self._original_queue = []
-        self._round_queue = []
-        self._round = 0
+        self._head = _TurnNode(None, 0)
+        self._head.prev = self._head
+        self._head.next = self._head
+        self._nodes = {}
+        self._size = 0
+        self._cursor = self._head
         self._active_char = None
+        self._round = 0
+
+    def _advance(self, node):
+        # next node that may act in the current round, or the head if the round is over
+        node = node.next
+        while node is not self._head:
+            if node.removed:
+                node = node.next
+            elif node.character.is_dead():
+                self.remove(node.character)
+                node = node.next
+            elif node.first_round > self._round:
+                node = node.next
+            else:
+                break
+        return node
 
     def get_next(self):
-        if len(self._round_queue) == 0:
-            if len(self._original_queue) > 0:
-                self._round_queue = self._original_queue.copy()
+        previous = self._cursor
+        node = self._advance(previous)
+        if node is self._head:
+            if self._size > 0:
                 self._round += 1
-                self._active_char = self._round_queue.pop(0)
-            else:
-                self._active_char = None
-        else:
-            self._active_char = self._round_queue.pop(0)
+                node = self._advance(self._head)
 
+        self._cursor = node
+        if previous.removed:
+            previous.prev.next = previous.next
+            previous.next.prev = previous.prev
+        self._active_char = node.character if node is not self._head else None
         return self._active_char
 
     def get_active(self):
@@ -41,7 +133,21 @@ class GameTurnOrder:
         return self._round
 
     def remove(self, char):
-        if char in self._original_queue:
-            self._original_queue.remove(char)
-            if char in self._round_queue:
-                self._round_queue.remove(char)
+        for node in self._nodes.pop(char.get_id(), []):
+            self._unlink(node)
+
+    def preview(self, amount):
+        # the next characters to act (including following rounds), without changing the order
+        upcoming = []
+        node, round_number = self._cursor, self._round
+        visited_head = 0
+        while len(upcoming) < amount and self._size > 0:
+            node = node.next
+            if node is self._head:
+                round_number += 1
+                visited_head += 1
+                if visited_head > 1 and not upcoming:
+                    break
+            elif not node.removed and not node.character.is_dead() and node.first_round <= round_number:
+                upcoming.append(node.character)
+        return upcoming
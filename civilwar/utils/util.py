@@ -1,6 +1,11 @@
 
 def clamp(value, min_value, max_value):
-    return max(min(value, max_value), min_value)
+    # same result as max(min(value, max_value), min_value), without the builtin calls
+    if value > max_value:
+        value = max_value
+    if value < min_value:
+        value = min_value
+    return value
 
 class CaseInsensitiveDict(dict):
 
@@ -4,9 +4,13 @@ from utils.json_serializable import JsonSerializable
 
 
 class Vector2D(JsonSerializable):
+
+    __slots__ = ["_x", "_y", "_json"]
+
     def __init__(self, x, y):
         self._x = x
         self._y = y
+        self._json = None
 
     def __add__(self, v2):
         return Vector2D(self._x + v2[0], self._y + v2[1])
@@ -49,3 +53,9 @@ class Vector2D(JsonSerializable):
 
     def to_json(self):
         return {"x": self._x, "y": self._y}
+
+    def serialize(self):
+        # vectors are never modified in place, the serialized form can be kept
+        if self._json is None:
+            self._json = self.to_json()
+        return self._json
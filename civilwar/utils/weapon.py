@@ -1,45 +1,57 @@
-import random
-
 from utils.api import create_response, create_error
+from utils.character_template import WeaponDefinition
 from utils.constants import MEELE_RANGE, OG_METER
 
 
 class Weapon:
 
-    def __init__(self, dictionary):
-        self._name = dictionary["name"]
-        self._hit = dictionary["hit"]
-        self._dices = dictionary["dices"]
-        self._dice_type = dictionary["diceType"]
-        self._type = dictionary["type"]
-        self._additional = 0 if "additional" not in dictionary.keys() else dictionary["additional"]
-        self._min_range = 0 if "minRange" not in dictionary.keys() else dictionary["minRange"]
-        self._max_range = MEELE_RANGE if "maxRange" not in dictionary.keys() else dictionary["maxRange"]
-        self._usages = -1 if "usages" not in dictionary.keys() else dictionary["usages"]
+    """A character's weapon: the shared WeaponDefinition plus this weapon's ammo and transform overlay."""
+
+    __slots__ = ["_definition", "_usages", "_damage"]
+
+    def __init__(self, definition: WeaponDefinition):
+        self._definition = definition
+        self._usages = definition.usages
+        # damage dice (dices, dice type, additional) replacing the definition's while transformed
+        self._damage = None
+
+    def get_definition(self):
+        return self._definition
 
     def get_max_range(self):
-        return self._max_range / OG_METER
+        return self._definition.max_range / OG_METER
 
     def is_ranged(self):
-        return self._max_range > MEELE_RANGE
+        return self._definition.max_range > MEELE_RANGE
 
     def get_name(self):
-        return self._name
+        return self._definition.name
+
+    def get_usages(self):
+        return self._usages
+
+    def get_damage(self):
+        definition = self._definition
+        return (definition.dices, definition.dice_type, definition.additional) if self._damage is None else self._damage
+
+    def set_damage(self, dices, dice_type, additional):
+        damage = (dices, dice_type, additional)
+        definition = self._definition
+        self._damage = None if damage == (definition.dices, definition.dice_type, definition.additional) else damage
 
-    def attack(self, distance, target):
-        if distance > self._max_range / OG_METER or distance < self._min_range / OG_METER:
+    def attack(self, distance, target, dice):
+        definition = self._definition
+        if distance > definition.max_range / OG_METER or distance < definition.min_range / OG_METER:
             return create_error("Can't reach target")
         if self._usages == 0:
             return create_error("No ammo")
         if self._usages > 0:
             self._usages -= 1
-        hit = random.randint(1, 20) + self._hit
+        hit = dice.d(20) + definition.hit
         if hit < target.get_armor():
             return create_error(f"Missed target: {hit}")
-        damage = self._additional
-        for i in range(self._dices):
-            damage += random.randint(1, self._dice_type)
-        if self._type in target.get_resistances():
+        damage = dice.roll(*self.get_damage())
+        if definition.type in target.get_resistances():
             damage = damage // 2
 
         target.change_health(-damage)
@@ -0,0 +1,151 @@
+import json
+import string
+
+from flask_socketio import emit
+
+from utils.api import json_serialize
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# field names shortened by the compact formats. ids are letters only, so they never collide with character ids
+COMPACT_FIELDS = [
+    "id", "name", "token", "tokenShadow", "pos", "status", "hp", "max_hp", "active_weapon", "weapons",
+    "is_ally", "type", "is_online", "characterId", "timestamp", "seq", "events", "characters", "to",
+    "movementLeft", "attacker", "victim", "hit", "damage", "reason", "success", "msg", "data", "round",
+    "active_char", "state", "factions", "full", "removed", "alive", "ko", "dead",
+]
+
+
+def _field_id(index):
+    letters = string.ascii_lowercase
+    field_id = ""
+    while True:
+        field_id = letters[index % len(letters)] + field_id
+        index = index // len(letters) - 1
+        if index < 0:
+            return field_id
+
+
+COMPACT_FIELD_IDS = dict((name, _field_id(index)) for index, name in enumerate(COMPACT_FIELDS))
+
+
+class WireFormat:
+
+    """Encodes already serialized payloads (see json_serialize) for one socket frame."""
+
+    name = "json"
+
+    def encode(self, data):
+        # socket.io json-encodes plain payloads itself
+        return data
+
+    def get_room(self, game_room):
+        # socket.io room of all clients of game_room using this format
+        return f"{game_room}:wireFormat:{self.name}"
+
+    def get_schema(self):
+        return None
+
+    @staticmethod
+    def frame_size(payload):
+        if isinstance(payload, bytes):
+            return len(payload)
+        return len(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+class CompactWireFormat(WireFormat):
+
+    """JSON with short field ids and positions packed as [x, y]."""
+
+    name = "compact"
+
+    def encode(self, data):
+        return self._compact(data)
+
+    def get_schema(self):
+        return {"fields": COMPACT_FIELD_IDS, "positions": "xy"}
+
+    def _compact(self, data):
+        if isinstance(data, dict):
+            if len(data) == 2 and "x" in data and "y" in data:
+                return [data["x"], data["y"]]
+            return dict((COMPACT_FIELD_IDS.get(key, key), self._compact(value)) for key, value in data.items())
+        elif isinstance(data, (list, tuple)):
+            return [self._compact(value) for value in data]
+        return data
+
+
+class MessagePackWireFormat(CompactWireFormat):
+
+    """The compact schema encoded as MessagePack, sent as a binary frame."""
+
+    name = "msgpack"
+
+    def encode(self, data):
+        return msgpack.packb(super().encode(data))
+
+
+DEFAULT_WIRE_FORMAT = WireFormat()
+
+WIRE_FORMATS = dict((wire_format.name, wire_format) for wire_format in [DEFAULT_WIRE_FORMAT, CompactWireFormat()])
+if msgpack is not None:
+    WIRE_FORMATS[MessagePackWireFormat.name] = MessagePackWireFormat()
+
+# (game room, wire format) of every connected client (sid)
+_clients = {}
+
+# game room => wire format name => number of clients using it
+_room_formats = {}
+
+
+def get_wire_format(name):
+    return WIRE_FORMATS.get(name, DEFAULT_WIRE_FORMAT)
+
+
+def get_client(client_sid):
+    return _clients.get(client_sid, None)
+
+
+def get_client_wire_format(client_sid):
+    client = _clients.get(client_sid, None)
+    return DEFAULT_WIRE_FORMAT if client is None else client[1]
+
+
+def set_client(client_sid, game_room, wire_format):
+    remove_client(client_sid)
+    _clients[client_sid] = (game_room, wire_format)
+    formats = _room_formats.setdefault(game_room, {})
+    formats[wire_format.name] = formats.get(wire_format.name, 0) + 1
+
+
+def remove_client(client_sid):
+    client = _clients.pop(client_sid, None)
+    if client is not None:
+        game_room, wire_format = client
+        formats = _room_formats[game_room]
+        formats[wire_format.name] -= 1
+        if formats[wire_format.name] == 0:
+            del formats[wire_format.name]
+        if not formats:
+            del _room_formats[game_room]
+
+
+def encode_for(client_sid, data):
+    return get_client_wire_format(client_sid).encode(json_serialize(data))
+
+
+def broadcast(event, data, game_room, emit_fn=None):
+    # encodes the payload once per wire format in use in the game room and sends it to the matching room.
+    # emit_fn is socketio.emit when broadcasting outside of a request context (shard events)
+    formats = _room_formats.get(game_room, None)
+    if not formats:
+        return
+
+    emit_fn = emit if emit_fn is None else emit_fn
+    data = json_serialize(data)
+    for name in list(formats.keys()):
+        wire_format = WIRE_FORMATS[name]
+        emit_fn(event, wire_format.encode(data), to=wire_format.get_room(game_room))
@@ -70,7 +70,7 @@ export default class API {
         this.sendRequest("chooseCharacter", {name: characterName, password: pw}, callback);
     }
 
-    fetchAllCharacters(callback) {
-        this.sendRequest("getCharacters", {}, callback);
+    fetchAllCharacters(callback, since = null) {
+        this.sendRequest("getCharacters", since === null ? {} : {since: since}, callback);
     }
 }
\ No newline at end of file
@@ -6,6 +6,7 @@ import {
     DialogContent,
     DialogContentText,
     DialogTitle, FormControlLabel,
+    MenuItem,
     TextField
 } from "@mui/material";
 import Button from "@mui/material/Button";
@@ -20,9 +21,10 @@ export default function NpcDialog(props) {
 
     const [npcAmount, setNPCAmount] = useState(20);
     const [npcAlly, setNPCAlly] = useState(true);
+    const [npcPlacement, setNPCPlacement] = useState("uniform");
 
     const addNpcs = () => {
-        let data = {"allies": npcAlly, "amount": npcAmount}
+        let data = {"allies": npcAlly, "amount": npcAmount, "placement": npcPlacement}
         api.sendRequest("createNPCs", data, (response) => {
             if (!response.success) {
                 alert(response.msg);
@@ -40,6 +42,12 @@ export default function NpcDialog(props) {
                 <TextField type={"number"} inputProps={{ min: 1 }} label="Amount" value={npcAmount}
                            size={"small"}
                            onChange={e => setNPCAmount(parseInt(e.target.value))}/>
+                <TextField select label="Placement" value={npcPlacement} size={"small"}
+                           onChange={e => setNPCPlacement(e.target.value)}>
+                    <MenuItem value={"uniform"}>Scattered</MenuItem>
+                    <MenuItem value={"clustered"}>Groups</MenuItem>
+                    <MenuItem value={"grid"}>Lines</MenuItem>
+                </TextField>
                 <FormControlLabel  label={"Spawn Allys?"} className={"checkbox-ally"}
                     control={<Checkbox label={"chk_ally?"} checked={npcAlly} onChange={() => setNPCAlly(!npcAlly)}/>} />
             </Box>
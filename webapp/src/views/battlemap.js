@@ -34,8 +34,25 @@ const reducer = (gameData, action) => {
         case "setAllCharacters":
             newGameData.characters = action.characters;
             break;
+        case "applyCharacterChanges":
+            newGameData.characters = {...newGameData.characters};
+            for (const [id, fields] of Object.entries(action.characters)) {
+                newGameData.characters[id] = {...newGameData.characters[id], ...fields};
+            }
+            for (const id of action.removed) {
+                delete newGameData.characters[id];
+            }
+            break;
         case "charactersSpawned":
-            newGameData.characters = {...newGameData.characters, ...action.characters};
+            // fields shared per template + [id, name, template, x, y] of every spawned character
+            newGameData.characters = {...newGameData.characters};
+            for (const [id, name, template, x, y] of action.characters) {
+                newGameData.characters[id] = {...action.templates[template], id: id, name: name, pos: {x: x, y: y}};
+            }
+            break;
+        case "terrainChanged":
+            // cells that are not open ground as [row, column, cost], obstacles have the cost null
+            newGameData.terrain = {cellSize: action.cellSize, cells: action.cells};
             break;
         case "characterDied":
             newGameData.characters[action.characterId].status = "dead";
@@ -110,6 +127,20 @@ const reducer = (gameData, action) => {
                 color: "yellow"
             });
             break;
+        case "npcPhaseStarted":
+        case "npcPhaseProgress":
+            newGameData.npcPhase = action.phase;
+            break;
+        case "npcPhaseFinished":
+            newGameData.npcPhase = null;
+            if (action.phase.cancelled) {
+                newGameData.log.push({
+                    timestamp: action.timestamp,
+                    color: 'orange',
+                    message: `NPC turns cancelled after ${action.phase.done} / ${action.phase.total}`
+                });
+            }
+            break;
         case "logMessage":
             newGameData.log.push({
                 message: action.msg,
@@ -135,7 +166,7 @@ export default function BattleMap(props) {
     const setCharacter = props.setCharacter;
 
     const [fetchCharacters, setFetchCharacters] = useState(true);
-    const [gameData, dispatch] = useReducer(reducer, null, () => ({characters: {[character.id]: character}, log: []}));
+    const [gameData, dispatch] = useReducer(reducer, null, () => ({characters: {[character.id]: character}, log: [], npcPhase: null, terrain: null}));
     const [mapSize, setMapSize] = useState([0, 0]);
     const [selectedCharacter, setSelectedCharacter] = useState(null);
     const [activeChar, setActiveChar] = useState(null);
@@ -148,17 +179,25 @@ export default function BattleMap(props) {
     const [changeHp, setChangeHp] = useState(false);
 
     const mapRef = useRef(null);
+    const stateSeq = useRef(null);
 
     const onFetchCharacters = useCallback(() => {
         if (fetchCharacters) {
             setFetchCharacters(false);
             api.fetchAllCharacters((response) => {
-                if (response.success) {
-                    dispatch({type: "setAllCharacters", characters: response.data});
-                } else {
+                if (!response.success) {
                     alert("Error fetching characters: " + response.msg);
+                    return;
                 }
-            });
+
+                if (response.data.full) {
+                    dispatch({type: "setAllCharacters", characters: response.data.characters});
+                } else {
+                    dispatch({type: "applyCharacterChanges", characters: response.data.characters,
+                        removed: response.data.removed});
+                }
+                stateSeq.current = response.data.seq;
+            }, stateSeq.current);
         }
     }, [api, fetchCharacters]);
 
@@ -209,27 +248,37 @@ export default function BattleMap(props) {
         setGameState(data.state);
     }, []);
 
-    const onGameEvent = useCallback((data) => {
-        console.log("onGameEvent", data);
-        dispatch(data);
+    const onGameEvents = useCallback((data) => {
+        console.log("onGameEvents", data);
+        for (const event of data.events) {
+            dispatch(event);
+        }
     }, []);
 
     useEffect(() => {
         onFetchCharacters();
     }, [onFetchCharacters]);
 
+    useEffect(() => {
+        api.sendRequest("getTerrain", {}, (response) => {
+            if (response.success) {
+                dispatch({type: "terrainChanged", ...response.data});
+            }
+        });
+    }, [api]);
+
     useEffect(() => {
         api.registerEvent("reset", onReset);
         api.registerEvent("gameStatus", onGameStatus);
-        api.registerEvent("gameEvent", onGameEvent);
+        api.registerEvent("gameEvents", onGameEvents);
 
         return () => {
             // dismount
             api.unregisterEvent("reset");
             api.unregisterEvent("gameStatus");
-            api.unregisterEvent("gameEvent");
+            api.unregisterEvent("gameEvents");
         }
-    }, [api, onReset, onGameStatus, onGameEvent]);
+    }, [api, onReset, onGameStatus, onGameEvents]);
 
     const onTokenDrag = useCallback((e, char) => {
         let img = mapRef.current;
@@ -276,6 +325,19 @@ export default function BattleMap(props) {
         isSelected={c.id === selectedCharacter}
     />);
 
+    let terrainCells = [];
+    if (mapRef.current && loaded && gameData.terrain) {
+        let img = mapRef.current;
+        let relX = mapSize[0] / img.naturalWidth, relY = mapSize[1] / img.naturalHeight;
+        let cellSize = gameData.terrain.cellSize;
+        terrainCells = gameData.terrain.cells.map(([row, column, cost]) => <div
+            key={"terrain-" + row + "-" + column}
+            className={cost === null ? "terrain-obstacle" : "terrain-rough"}
+            style={{left: Math.floor(relX * column * cellSize), top: Math.floor(relY * row * cellSize),
+                width: Math.ceil(relX * cellSize), height: Math.ceil(relY * cellSize)}}
+        />);
+    }
+
     const messages = gameData.log.map(entry => <EventMessage
         eventMessage={entry.message}
         color={entry.color}
@@ -298,6 +360,7 @@ export default function BattleMap(props) {
             <img className="battlemap" src={"/img/battlemap.png"} alt="BattleMap" ref={mapRef}
                  onLoad={() => setLoaded(true)}
                  onResize={(e) => mapRef.current && setMapSize([e.clientWidth, e.clientHeight])}/>
+            {terrainCells}
             {tokens}
         </div>
         <div className="event-container">
@@ -309,6 +372,7 @@ export default function BattleMap(props) {
                     Round {round} -
                     State: {gameState}
                     {activeChar ? <> - Active Character: {gameData.characters[activeChar].name}</> : <></>}
+                    {gameData.npcPhase ? <> - NPC turns: {gameData.npcPhase.done} / {gameData.npcPhase.total}</> : <></>}
                 </div>
             </div>
             <div className="event-log">
@@ -336,7 +400,10 @@ export default function BattleMap(props) {
                 </div> :
                 <div className="dm-interface">
                     <Button variant="contained" onClick={() => onAction("start")}>Start</Button>
-                    <Button variant="contained" onClick={() => onAction("continue")}>Continue</Button>
+                    <Button variant="contained" onClick={() => onAction("continue")}
+                            disabled={gameData.npcPhase !== null}>Continue</Button>
+                    <Button variant="contained" onClick={() => onAction("cancelPhase")}
+                            disabled={gameData.npcPhase === null}>Cancel NPC Turns</Button>
                     <Button variant="contained" onClick={() => onAction("reset")}>Reset</Button>
                     <Button variant="contained" onClick={() => setChangeHp(true)} disabled={selectedCharacter === null}>Change HP</Button>
                     <Button variant="contained" onClick={() => onAction("kill")} disabled={selectedCharacter === null}>Kill</Button>